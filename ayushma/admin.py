@@ -11,7 +11,15 @@ from ayushma.models.testsuite import (
     TestSuite,
 )
 
-from .models import APIKey, Chat, ChatMessage, Document, Project, User
+from .models import (
+    APIKey,
+    Chat,
+    ChatAnswerCache,
+    ChatMessage,
+    Document,
+    Project,
+    User,
+)
 
 
 @admin.register(User)
@@ -93,6 +101,12 @@ class ChatMessageAdmin(DjangoQLSearchMixin, admin.ModelAdmin):
     pass
 
 
+@admin.register(ChatAnswerCache)
+class ChatAnswerCacheAdmin(DjangoQLSearchMixin, admin.ModelAdmin):
+    list_display = ("id", "project", "chat_message", "hits", "created_at")
+    exclude = ("embedding",)
+
+
 @admin.register(Project)
 class ProjectAdmin(DjangoQLSearchMixin, admin.ModelAdmin):
     pass
@@ -0,0 +1,132 @@
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from ayushma.models import Document, Project
+from ayushma.models.testsuite import TestQuestion, TestSuite
+from ayushma.utils.chunker import chunkers
+from ayushma.utils.openaiapi import (
+    batch_by_tokens,
+    get_cached_embedding,
+    get_embedding,
+)
+from ayushma.utils.upsert import get_document_chunks, get_document_source
+
+
+class Command(BaseCommand):
+    help = (
+        "Chunks the documents of a project with each chunking strategy and reports "
+        "the number of vectors, the index size and the recall of the documents "
+        "referenced by the test questions. Vectors are kept in memory, the vector "
+        "db of the project is not modified. Embeds every document once per strategy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("project", help="External id of the project")
+        parser.add_argument(
+            "--test-suite",
+            action="append",
+            help="External id of a test suite to use (default: all test suites)",
+        )
+        parser.add_argument(
+            "--strategy",
+            action="append",
+            choices=list(chunkers.keys()),
+            help="Chunking strategy to benchmark (default: all strategies)",
+        )
+        parser.add_argument(
+            "--top-k",
+            type=int,
+            help="Number of chunks to retrieve (default: the test suite's topk)",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            project = Project.objects.get(external_id=options["project"])
+        except (Project.DoesNotExist, ValueError):
+            raise CommandError(f"Project {options['project']} does not exist")
+
+        documents = list(Document.objects.filter(project=project, uploading=False))
+        strategies = options["strategy"] or list(chunkers.keys())
+        chunks = {strategy: {} for strategy in strategies}
+        for document in documents:
+            for strategy in strategies:
+                try:
+                    chunks[strategy][str(document.external_id)] = self.get_chunks(
+                        document, strategy
+                    )
+                except Exception as e:
+                    self.stderr.write(f"Skipping document {document.title}: {e}")
+        subjects = set.intersection(
+            *[set(document_chunks) for document_chunks in chunks.values()]
+        )
+
+        test_suites = TestSuite.objects.all()
+        if options["test_suite"]:
+            test_suites = test_suites.filter(external_id__in=options["test_suite"])
+        questions = []
+        for question in TestQuestion.objects.filter(
+            test_suite__in=test_suites
+        ).prefetch_related("documents", "test_suite"):
+            relevant = {
+                str(document.external_id)
+                for document in question.documents.all()
+                if str(document.external_id) in subjects
+            }
+            if relevant:
+                questions.append((question, relevant))
+
+        if not questions:
+            raise CommandError(
+                "No test questions reference documents of this project, recall "
+                "cannot be measured"
+            )
+
+        query_embeddings = get_cached_embedding(
+            [question.question for question, _ in questions]
+        )
+
+        for strategy in strategies:
+            self.benchmark(
+                strategy,
+                {subject: chunks[strategy][subject] for subject in subjects},
+                questions,
+                query_embeddings,
+                options,
+            )
+
+    def get_chunks(self, document, strategy):
+        # chunks with their token counts
+        return get_document_chunks(strategy, **get_document_source(document))
+
+    def benchmark(
+        self, strategy, document_chunks, questions, query_embeddings, options
+    ):
+        subjects = []
+        chunks = []
+        for subject, items in document_chunks.items():
+            subjects += [subject] * len(items)
+            chunks += items.items()
+
+        # batched the way upsert batches them
+        vectors = []
+        for batch in batch_by_tokens(chunks, count=lambda chunk: chunk[1]):
+            vectors += get_embedding([chunk for chunk, _ in batch])
+        matrix = np.asarray(vectors, dtype=np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+        size = matrix.nbytes + sum(len(chunk.encode()) for chunk, _ in chunks)
+
+        recalls = []
+        for (question, relevant), embedding in zip(questions, query_embeddings):
+            top_k = options["top_k"] or question.test_suite.topk
+            query = np.asarray(embedding, dtype=np.float32)
+            scores = matrix @ (query / np.linalg.norm(query))
+            top = np.argsort(-scores)[:top_k]
+            retrieved = {subjects[i] for i in top}
+            recalls.append(len(relevant & retrieved) / len(relevant))
+
+        self.stdout.write(
+            f"{strategy}: vectors={len(chunks)} "
+            f"index_size={size / 1024 / 1024:.2f}MB "
+            f"recall={sum(recalls) / len(recalls):.3f} "
+            f"({len(recalls)} questions)"
+        )
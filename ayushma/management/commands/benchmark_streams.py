@@ -0,0 +1,105 @@
+import asyncio
+import statistics
+import time
+
+import httpx
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Opens concurrent streaming converse requests against a running server and "
+        "reports how many streams completed and their latencies. Run it once against "
+        "the WSGI server and once against the ASGI server with the same worker count "
+        "to compare streams per worker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "url",
+            help="Converse endpoint, e.g. http://localhost:5000/api/projects/<id>/chats/<id>/converse",
+        )
+        parser.add_argument("--concurrency", type=int, default=50)
+        parser.add_argument("--text", default="What is the normal heart rate?")
+        parser.add_argument("--auth-token", help="Value for the Authorization header")
+        parser.add_argument("--api-key", help="Value for the X-API-KEY header")
+        parser.add_argument("--openai-key", help="Value for the OpenAI-Key header")
+        parser.add_argument("--timeout", type=float, default=300)
+        parser.add_argument(
+            "--generate-audio",
+            action="store_true",
+            help="Include TTS in each response (off by default to isolate streaming)",
+        )
+
+    def handle(self, *args, **options):
+        headers = {}
+        if options["auth_token"]:
+            headers["Authorization"] = options["auth_token"]
+        if options["api_key"]:
+            headers["X-API-KEY"] = options["api_key"]
+        if options["openai_key"]:
+            headers["OpenAI-Key"] = options["openai_key"]
+
+        results = asyncio.run(self.run(options, headers))
+
+        completed = [result for result in results if result["ok"]]
+        self.stdout.write(f"Streams started: {len(results)}")
+        self.stdout.write(f"Streams completed: {len(completed)}")
+        if not completed:
+            return
+
+        first_byte = [result["first_byte"] for result in completed]
+        total = [result["total"] for result in completed]
+        self.stdout.write(
+            f"Time to first event (s): p50={statistics.median(first_byte):.2f} "
+            f"max={max(first_byte):.2f}"
+        )
+        self.stdout.write(
+            f"Stream duration (s): p50={statistics.median(total):.2f} "
+            f"max={max(total):.2f}"
+        )
+        self.stdout.write(
+            f"Events received: {sum(result['events'] for result in completed)}"
+        )
+
+    async def run(self, options, headers):
+        limits = httpx.Limits(max_connections=options["concurrency"])
+        async with httpx.AsyncClient(
+            headers=headers, limits=limits, timeout=options["timeout"]
+        ) as client:
+            return await asyncio.gather(
+                *[
+                    self.stream(
+                        client,
+                        options["url"],
+                        {
+                            "text": options["text"],
+                            "stream": "true",
+                            "generate_audio": str(options["generate_audio"]).lower(),
+                        },
+                    )
+                    for _ in range(options["concurrency"])
+                ]
+            )
+
+    async def stream(self, client, url, data):
+        start = time.time()
+        result = {"ok": False, "first_byte": None, "total": None, "events": 0}
+        try:
+            # converse only accepts multipart bodies
+            files = {key: (None, value) for key, value in data.items()}
+            async with client.stream("POST", url, files=files) as response:
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    if result["first_byte"] is None:
+                        result["first_byte"] = time.time() - start
+                    result["events"] += 1
+                    if '"error": true' in line:
+                        break
+                else:
+                    result["ok"] = response.status_code == 200 and result["events"] > 0
+        except httpx.HTTPError as e:
+            self.stderr.write(f"Stream failed: {e}")
+        result["total"] = time.time() - start
+        return result
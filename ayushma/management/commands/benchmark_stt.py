@@ -0,0 +1,98 @@
+import os
+import time
+
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+
+from ayushma.models.enums import STTEngine
+from ayushma.utils.audio_processing import get_ffmpeg, split_audio
+from ayushma.utils.speech_to_text import engines, get_engine, iter_speech_to_text
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs audio files through the speech to text path of uploads: decoding, "
+        "silence trimming, splitting into chunks, encoding and the concurrent "
+        "transcription of the chunks. Reports the bytes sent to the engine, the "
+        "time to split and encode, and the time to the first and the full "
+        "transcript against transcribing the upload as it is in one request."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("files", nargs="+", help="Audio files to benchmark")
+        parser.add_argument(
+            "--engine",
+            choices=list(engines.keys()),
+            default="whisper",
+            help="Speech to text engine to transcribe with (default: whisper)",
+        )
+        parser.add_argument(
+            "--language", default="en", help="Language of the audio (default: en)"
+        )
+        parser.add_argument(
+            "--no-transcribe",
+            action="store_true",
+            help="Only measure the splitting and encoding, do not call the engine",
+        )
+
+    def handle(self, *args, **options):
+        if not get_ffmpeg():
+            raise CommandError("ffmpeg is required to preprocess audio")
+
+        engine_id = STTEngine.get_id_from_name(options["engine"])
+        language_code = options["language"] + "-IN"
+        engine, _ = get_engine(engine_id, language_code)
+        totals = {"original": 0, "processed": 0}
+        for path in options["files"]:
+            with open(path, "rb") as file:
+                original = File(file, name=os.path.basename(path))
+                start = time.time()
+                chunks = list(split_audio(original))
+                split_time = time.time() - start
+                original.seek(0)
+                if chunks[0] is original:
+                    self.stderr.write(f"{path}: could not be preprocessed")
+                    continue
+
+                processed = sum(chunk.size for chunk in chunks)
+                totals["original"] += original.size
+                totals["processed"] += processed
+                self.stdout.write(
+                    f"{path}: bytes={original.size} -> {processed} "
+                    f"({processed / original.size:.1%}) chunks={len(chunks)} "
+                    f"split={split_time:.2f}s"
+                )
+                if options["no_transcribe"]:
+                    continue
+
+                start = time.time()
+                try:
+                    transcript = engine.recognize(original)
+                except ValueError as e:
+                    transcript = f"<{e}>"
+                self.stdout.write(
+                    f"  original: latency={time.time() - start:.2f}s "
+                    f"transcript={transcript!r}"
+                )
+
+                original.seek(0)
+                start = time.time()
+                first = None
+                try:
+                    for transcript in iter_speech_to_text(
+                        engine_id, original, language_code
+                    ):
+                        first = first or time.time() - start
+                except ValueError as e:
+                    transcript = f"<{e}>"
+                first = f"{first:.2f}s" if first else "-"
+                self.stdout.write(
+                    f"  chunked: first={first} latency={time.time() - start:.2f}s "
+                    f"transcript={transcript!r}"
+                )
+
+        if totals["original"]:
+            self.stdout.write(
+                f"total: bytes={totals['original']} -> {totals['processed']} "
+                f"({totals['processed'] / totals['original']:.1%})"
+            )
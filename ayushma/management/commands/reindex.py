@@ -0,0 +1,152 @@
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from ayushma.models import Document, Project
+from ayushma.tasks.upsertdoc import reindex_doc
+from ayushma.utils.answer_cache import invalidate_answer_cache
+from ayushma.utils.upsert import reindex_document
+
+
+class Command(BaseCommand):
+    help = (
+        "Upserts every document again in database order, e.g. after changing the "
+        "chunker or the vector db, or the embedding model with --force. Progress "
+        "is saved to a checkpoint file after every document, so an interrupted run "
+        "resumes where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--project",
+            action="append",
+            help="External id of a project to reindex (default: all projects)",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Documents processed at once (default: 4)",
+        )
+        parser.add_argument(
+            "--celery",
+            action="store_true",
+            help="Process documents on the celery workers instead of local processes",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Write every chunk again, e.g. after changing the embedding model. "
+            "Chunks are embedded again unless the embedding store has them for "
+            "the current model",
+        )
+        parser.add_argument("--checkpoint", default="reindex_checkpoint.json")
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore the checkpoint and start from the first document",
+        )
+
+    def handle(self, *args, **options):
+        self.checkpoint_path = options["checkpoint"]
+        checkpoint = {"last_id": 0, "failed": []}
+        if not options["restart"] and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+            self.stdout.write(f"Resuming after document {checkpoint['last_id']}")
+
+        documents = Document.objects.filter(
+            uploading=False, id__gt=checkpoint["last_id"]
+        )
+        if options["project"]:
+            documents = documents.filter(project__external_id__in=options["project"])
+        # read before the workers are forked, so no cursor is open at that point
+        documents = list(
+            documents.order_by("id").values_list("id", "external_id", "project_id")
+        )
+
+        self.start = time.time()
+        self.totals = {
+            "documents": 0,
+            "chunks": 0,
+            "new": 0,
+            "embedded": 0,
+            "tokens": 0,
+            "stored": 0,
+        }
+        self.celery = options["celery"]
+        self.force = options["force"]
+        workers = max(options["workers"], 1)
+        project_ids = set()
+
+        if not self.celery:
+            # forked workers must not share the database connection
+            connections.close_all()
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+
+        # results are collected in order so the checkpoint never skips a document
+        pending = deque()
+        try:
+            for id, external_id, project_id in documents:
+                if len(pending) >= workers * 2:
+                    self.complete(checkpoint, *pending.popleft())
+                pending.append((id, external_id, self.submit(str(external_id))))
+                project_ids.add(project_id)
+            while pending:
+                self.complete(checkpoint, *pending.popleft())
+        finally:
+            if not self.celery:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+
+        for project in Project.objects.filter(id__in=project_ids):
+            invalidate_answer_cache(project)
+
+        self.stdout.write(f"Finished: {self.progress()}")
+        if checkpoint["failed"]:
+            self.stdout.write(
+                f"Failed documents: {', '.join(checkpoint['failed'])}. "
+                "Fix them and upload them again."
+            )
+
+    def submit(self, document_id):
+        if self.celery:
+            return reindex_doc.delay(document_id, self.force)
+        return self.executor.submit(reindex_document, document_id, self.force)
+
+    def result(self, task):
+        if self.celery:
+            return task.get()
+        return task.result()
+
+    def complete(self, checkpoint, id, external_id, task):
+        try:
+            stats = self.result(task)
+            for key in ("chunks", "new", "embedded", "tokens", "stored"):
+                self.totals[key] += stats[key]
+        except Exception as e:
+            self.stderr.write(f"Error reindexing document {external_id}: {e}")
+            checkpoint["failed"].append(str(external_id))
+        self.totals["documents"] += 1
+
+        checkpoint["last_id"] = id
+        with open(self.checkpoint_path + ".tmp", "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(self.checkpoint_path + ".tmp", self.checkpoint_path)
+
+        self.stdout.write(self.progress())
+
+    def progress(self):
+        elapsed = max(time.time() - self.start, 1e-6)
+        return (
+            f"{self.totals['documents']} documents, "
+            f"{self.totals['chunks']} chunks ({self.totals['chunks'] / elapsed:.1f}/s), "
+            f"{self.totals['new']} written, "
+            f"{self.totals['embedded']} embedded, "
+            f"{self.totals['stored']} from the embedding store, "
+            f"{self.totals['tokens']} tokens ({self.totals['tokens'] / elapsed:.1f}/s)"
+        )
@@ -0,0 +1,72 @@
+# Generated by Django 4.2.6 on 2026-10-18 19:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ayushma", "0055_testresult_model_testrun_models"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="project",
+            name="answer_cache",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="project",
+            name="answer_cache_threshold",
+            field=models.FloatField(default=0.95),
+        ),
+        migrations.CreateModel(
+            name="ChatAnswerCache",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "external_id",
+                    models.UUIDField(db_index=True, default=uuid.uuid4, unique=True),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, db_index=True, null=True),
+                ),
+                (
+                    "modified_at",
+                    models.DateTimeField(auto_now=True, db_index=True, null=True),
+                ),
+                ("deleted", models.BooleanField(db_index=True, default=False)),
+                ("key", models.CharField(db_index=True, max_length=64)),
+                ("embedding", models.BinaryField()),
+                ("hits", models.IntegerField(default=0)),
+                (
+                    "chat_message",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="ayushma.chatmessage",
+                    ),
+                ),
+                (
+                    "project",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="ayushma.project",
+                    ),
+                ),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+    ]
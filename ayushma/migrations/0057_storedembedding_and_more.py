@@ -0,0 +1,53 @@
+# Generated by Django 4.2.6 on 2026-10-18 19:33
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        (
+            "ayushma",
+            "0056_project_answer_cache_project_answer_cache_threshold_and_more",
+        ),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StoredEmbedding",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "external_id",
+                    models.UUIDField(db_index=True, default=uuid.uuid4, unique=True),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, db_index=True, null=True),
+                ),
+                (
+                    "modified_at",
+                    models.DateTimeField(auto_now=True, db_index=True, null=True),
+                ),
+                ("deleted", models.BooleanField(db_index=True, default=False)),
+                ("model", models.CharField(max_length=255)),
+                ("text_hash", models.CharField(max_length=64)),
+                ("embedding", models.BinaryField()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="storedembedding",
+            constraint=models.UniqueConstraint(
+                fields=("model", "text_hash"), name="unique_stored_embedding"
+            ),
+        ),
+    ]
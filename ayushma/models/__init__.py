@@ -1,5 +1,6 @@
 from .chat import *  # noqa
 from .document import *  # noqa
+from .embedding import *  # noqa
 from .enums import *  # noqa
 from .project import *  # noqa
 from .services import *  # noqa
@@ -47,3 +47,13 @@ class ChatFeedback(BaseModel):
     chat_message = models.ForeignKey(ChatMessage, on_delete=models.PROTECT)
     liked = models.BooleanField()
     message = models.TextField(blank=True, null=True)
+
+
+class ChatAnswerCache(BaseModel):
+    project = models.ForeignKey(Project, on_delete=models.CASCADE)
+    # hash of the prompt, model and language the answer was generated for
+    key = models.CharField(max_length=64, db_index=True)
+    # float32 embedding of the english query
+    embedding = models.BinaryField()
+    chat_message = models.ForeignKey(ChatMessage, on_delete=models.CASCADE)
+    hits = models.IntegerField(default=0)
@@ -0,0 +1,18 @@
+from django.db import models
+
+from utils.models.base import BaseModel
+
+
+class StoredEmbedding(BaseModel):
+    model = models.CharField(max_length=255)
+    # sha256 of the embedded text
+    text_hash = models.CharField(max_length=64)
+    # float32 embedding of the text
+    embedding = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["model", "text_hash"], name="unique_stored_embedding"
+            )
+        ]
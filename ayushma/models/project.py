@@ -23,6 +23,9 @@ class Project(BaseModel):
     preset_questions = ArrayField(models.TextField(), null=True, blank=True)
     is_default = models.BooleanField(default=False)
     archived = models.BooleanField(default=False)
+    # serve answers of semantically similar first questions from ChatAnswerCache
+    answer_cache = models.BooleanField(default=False)
+    answer_cache_threshold = models.FloatField(default=0.95)
 
     def __str__(self) -> str:
         return f"{self.title} by {self.creator.username}{' (default)' if self.is_default else ''}"
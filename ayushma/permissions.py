@@ -2,6 +2,7 @@ from django.utils import timezone
 from rest_framework import permissions
 
 from ayushma.models.services import TempToken
+from ayushma.utils.audio_stream import is_audio_url_signed
 from utils.helpers import get_client_ip
 
 
@@ -21,8 +22,9 @@ class IsUserOrReadOnly(permissions.IsAuthenticated):
 
 class IsTempTokenOrAuthenticated(permissions.IsAuthenticated):
     def has_permission(self, request, view):
-        auth_token: str = request.headers.get("Authorization")
-        auth_token = auth_token.split(" ")[1]
+        # audio players requesting signed urls send no header
+        auth_token: str = request.headers.get("Authorization", "")
+        auth_token = auth_token.split(" ")[-1]
         if auth_token.startswith("tt"):
             print("temp token")
             temptoken: TempToken = TempToken.objects.get(token=auth_token)
@@ -33,3 +35,14 @@ class IsTempTokenOrAuthenticated(permissions.IsAuthenticated):
                 request.service = temptoken.api_key.service
                 return True
         return bool(request.user and request.user.is_authenticated)
+
+
+class HasSignedAudioUrl(permissions.BasePermission):
+    """Requests for the audio of a message with its signed url (see get_audio_url)."""
+
+    def has_permission(self, request, view):
+        return is_audio_url_signed(
+            request,
+            view.kwargs.get("external_id"),
+            view.kwargs.get("message_external_id"),
+        )
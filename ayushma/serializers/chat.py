@@ -1,11 +1,10 @@
-from django.conf import settings
-from openai import OpenAI
 from rest_framework import serializers
 
 from ayushma.models import Chat, ChatFeedback, ChatMessage
 from ayushma.models.enums import ChatMessageType
 from ayushma.serializers.document import DocumentSerializer
 from ayushma.serializers.project import ProjectSerializer
+from ayushma.utils.openai_client import get_openai_client
 
 
 class ChatSerializer(serializers.ModelSerializer):
@@ -141,7 +140,7 @@ class ChatDetailSerializer(serializers.ModelSerializer):
         )
 
     def get_chats(self, obj):
-        client = OpenAI(api_key=settings.OPENAI_API_KEY)
+        client = get_openai_client()
         if obj.thread_id:
             thread_messages = client.beta.threads.messages.list(
                 obj.thread_id, limit=100, order="asc"
@@ -168,3 +167,5 @@ class ChatDetailSerializer(serializers.ModelSerializer):
 class SpeechToTextSerializer(serializers.Serializer):
     audio = serializers.FileField(required=True)
     language = serializers.CharField(default="en")
+    # stream the transcript as the chunks of a long recording are transcribed
+    stream = serializers.BooleanField(default=False)
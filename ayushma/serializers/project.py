@@ -1,10 +1,9 @@
 from random import sample
 
-from django.conf import settings
-from openai import OpenAI
 from rest_framework import serializers
 
 from ayushma.models import Project
+from ayushma.utils.openai_client import get_openai_client
 
 
 class ProjectSerializer(serializers.ModelSerializer):
@@ -58,6 +57,8 @@ class ProjectUpdateSerializer(serializers.ModelSerializer):
             "open_ai_key",
             "key_set",
             "preset_questions",
+            "answer_cache",
+            "answer_cache_threshold",
         )
         extra_kwargs = {
             "open_ai_key": {"write_only": True},
@@ -73,7 +74,7 @@ class ProjectUpdateSerializer(serializers.ModelSerializer):
         assistant_id = validated_data.get("assistant_id") or project.assistant_id
 
         if assistant_id:
-            client = OpenAI(api_key=settings.OPENAI_API_KEY)
+            client = get_openai_client()
             assistant = client.beta.assistants.retrieve(assistant_id)
             prompt = validated_data.pop("prompt", assistant.instructions)
             model = validated_data.pop("model", assistant.model)
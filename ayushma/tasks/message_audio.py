@@ -0,0 +1,14 @@
+from celery import shared_task
+
+from ayushma.utils.audio_stream import save_message_audio
+
+
+# retried well within TTS_STREAM_CACHE_TIMEOUT, the stream is read from the cache
+@shared_task(bind=True, acks_late=True, max_retries=5, default_retry_delay=30)
+def save_streamed_audio(self, chat_message_id: int, message_id: str, speech_name):
+    try:
+        if not save_message_audio(chat_message_id, message_id, speech_name):
+            print(f"Audio stream of message {chat_message_id} expired, not saved")
+    except Exception as e:
+        print(f"Error saving audio of message {chat_message_id}: {e}")
+        raise self.retry(exc=e)
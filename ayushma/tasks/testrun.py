@@ -1,3 +1,4 @@
+from collections import defaultdict
 from time import sleep
 
 import openai
@@ -9,7 +10,7 @@ from nltk.translate.bleu_score import SmoothingFunction, sentence_bleu
 from ayushma.models.chat import Chat
 from ayushma.models.enums import StatusChoices
 from ayushma.models.testsuite import TestResult, TestRun
-from ayushma.utils.language_helpers import translate_text
+from ayushma.utils.language_helpers import translate_text, translate_texts
 from ayushma.utils.openaiapi import (
     converse,
     converse_thread,
@@ -18,6 +19,38 @@ from ayushma.utils.openaiapi import (
 )
 
 
+def translate_questions(test_questions):
+    """
+    English text and its translation back to the language of each question that
+    is not in english, keyed by question id. One request per language for the
+    whole suite, instead of two per question for every model.
+    """
+    questions = [question for question in test_questions if question.language != "en"]
+    if not questions:
+        return {}
+    try:
+        english_texts = translate_texts(
+            "en-IN", [question.question for question in questions], shared=True
+        )
+        by_language = defaultdict(list)
+        for question, english_text in zip(questions, english_texts):
+            by_language[question.language].append((question.id, english_text))
+        translations = {}
+        for language, items in by_language.items():
+            translated_texts = translate_texts(
+                language + "-IN", [text for _, text in items], shared=True
+            )
+            for (question_id, english_text), translated_text in zip(
+                items, translated_texts
+            ):
+                translations[question_id] = (english_text, translated_text)
+        return translations
+    except Exception as e:
+        # each question is translated on its own, and fails on its own
+        print(f"Error translating test questions: {e}")
+        return {}
+
+
 @shared_task(bind=True, soft_time_limit=21600)  # 6 hours in seconds
 def mark_test_run_as_completed(self, test_run_id):
     try:
@@ -34,6 +67,7 @@ def mark_test_run_as_completed(self, test_run_id):
 
         temperature = test_suite.temperature
         topk = test_suite.topk
+        translations = translate_questions(test_questions)
 
         for model in test_models:
 
@@ -65,10 +99,14 @@ def mark_test_run_as_completed(self, test_run_id):
                     english_text = test_question.question
                     translated_text = test_question.question
 
-                    if test_question.language != "en":
-                        english_text = translate_text("en-IN", english_text)
+                    if test_question.id in translations:
+                        english_text, translated_text = translations[test_question.id]
+                    elif test_question.language != "en":
+                        english_text = translate_text(
+                            "en-IN", english_text, shared=True
+                        )
                         translated_text = translate_text(
-                            test_question.language + "-IN", english_text
+                            test_question.language + "-IN", english_text, shared=True
                         )
 
                     if test_run.project.assistant_id:
@@ -93,6 +131,8 @@ def mark_test_run_as_completed(self, test_run_id):
                                 generate_audio=False,
                                 fetch_references=test_run.references,
                                 documents=test_question.documents.all(),
+                                # the scores are of the model, not of cached answers
+                                use_answer_cache=False,
                             )
                         )
                         ai_response = response.message
@@ -6,7 +6,8 @@ from django.conf import settings
 
 from ayushma.models.document import Document
 from ayushma.models.enums import DocumentType
-from ayushma.utils.upsert import upsert
+from ayushma.utils.answer_cache import invalidate_answer_cache
+from ayushma.utils.upsert import reindex_document, upsert
 
 
 @shared_task(bind=True, soft_time_limit=21600)  # 6 hours in seconds
@@ -41,6 +42,7 @@ def upsert_doc(self, document_id: str, document_url: str = None):
 
         document.uploading = False
         document.save()
+        invalidate_answer_cache(document.project)
 
     except SoftTimeLimitExceeded:
         print("SoftTimeLimitExceeded")
@@ -48,3 +50,8 @@ def upsert_doc(self, document_id: str, document_url: str = None):
         document.save()
         document.delete()
         return
+
+
+@shared_task(bind=True, soft_time_limit=21600)  # 6 hours in seconds
+def reindex_doc(self, document_id: str, force: bool = False):
+    return reindex_document(document_id, force)
@@ -0,0 +1,65 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from ayushma.utils.incremental_speech import IncrementalSpeech
+
+REFERENCES = (
+    "\nReferences: [3f1c8f0e-6a4b-4a53-9d2e-7b1c2a9e4d10, "
+    "9b2d7c41-52e8-4d6f-a0c3-1e8f5b6d2a77]"
+)
+
+
+def tokenize(text, size=4):
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+@mock.patch(
+    "ayushma.utils.incremental_speech.text_to_speech",
+    side_effect=lambda text, *args: text.encode(),
+)
+@mock.patch(
+    "ayushma.utils.incremental_speech.translate_text",
+    side_effect=lambda language, text: text.upper(),
+)
+class IncrementalSpeechTestCase(SimpleTestCase):
+    def speak(self, answer, user_language="hi-IN"):
+        speech = IncrementalSpeech(user_language, tts_engine=1)
+        for token in tokenize(answer):
+            speech.feed(token)
+        return speech.finish({})
+
+    def test_references_are_not_voiced(self, translate_text, text_to_speech):
+        answer = (
+            "Paracetamol can be given every six hours when the fever is high. "
+            "Keep the child hydrated." + REFERENCES
+        )
+        text, audio = self.speak(answer)
+
+        voiced = " ".join(call.args[0] for call in text_to_speech.call_args_list)
+        translated = " ".join(call.args[1] for call in translate_text.call_args_list)
+        for output in (voiced, translated, text, audio.decode()):
+            self.assertNotIn("REFERENCES", output.upper())
+            self.assertNotIn("3F1C8F0E", output.upper())
+        self.assertEqual(
+            text,
+            "PARACETAMOL CAN BE GIVEN EVERY SIX HOURS WHEN THE FEVER IS HIGH. "
+            "KEEP THE CHILD HYDRATED.",
+        )
+
+    def test_short_sentence_before_references(self, translate_text, text_to_speech):
+        # shorter than a segment, so it would be joined with the references
+        text, _ = self.speak("Rest well." + REFERENCES)
+
+        self.assertEqual(text, "REST WELL.")
+        translate_text.assert_called_once_with("hi-IN", "Rest well.")
+
+    def test_tokens_after_references_are_ignored(self, translate_text, text_to_speech):
+        speech = IncrementalSpeech("en-IN", tts_engine=1)
+        for token in ["Drink water.", "\nRefer", "ences: [", "abc]", " More text."]:
+            speech.feed(token)
+        text, audio = speech.finish({})
+
+        self.assertEqual(text, "Drink water.")
+        self.assertEqual(audio, b"Drink water.")
+        translate_text.assert_not_called()
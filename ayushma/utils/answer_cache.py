@@ -0,0 +1,127 @@
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+
+from ayushma.models.chat import ChatAnswerCache, ChatMessage
+from ayushma.models.enums import ChatMessageType
+from ayushma.utils.cache import LRUCache, hash_key
+from ayushma.utils.speech_cache import text_to_speech_file
+
+# (project id, key) -> (version, entry ids, normalised embedding matrix)
+answer_cache_matrices = LRUCache(maxsize=64)
+
+
+def get_answer_cache_key(prompt, model, language):
+    return hash_key(prompt, model, language)
+
+
+def get_answer_cache_version(project):
+    return cache.get(f"answer_cache_version:{project.id}", 0)
+
+
+def bump_answer_cache_version(project):
+    key = f"answer_cache_version:{project.id}"
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def find_cached_answer(project, key, embedding):
+    """
+    Returns the cached answer whose query is the most similar to `embedding` if
+    the cosine similarity is at least the project's threshold, otherwise None.
+    """
+    version = get_answer_cache_version(project)
+    cached = answer_cache_matrices.get((project.id, key))
+    if not cached or cached[0] != version:
+        entries = list(
+            ChatAnswerCache.objects.filter(project=project, key=key)
+            .order_by("-created_at")
+            .values_list("id", "embedding")[: settings.ANSWER_CACHE_MAX_ENTRIES]
+        )
+        ids = [entry[0] for entry in entries]
+        matrix = np.array(
+            [np.frombuffer(entry[1], dtype=np.float32) for entry in entries],
+            dtype=np.float32,
+        )
+        if len(ids):
+            matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+        cached = (version, ids, matrix)
+        answer_cache_matrices.set((project.id, key), cached)
+
+    _, ids, matrix = cached
+    if not ids:
+        return None
+
+    query = np.asarray(embedding, dtype=np.float32)
+    scores = matrix @ (query / np.linalg.norm(query))
+    best = int(np.argmax(scores))
+    if scores[best] < project.answer_cache_threshold:
+        return None
+
+    entry = (
+        ChatAnswerCache.objects.select_related("chat_message")
+        .filter(id=ids[best])
+        .first()
+    )
+    if not entry:
+        return None
+    ChatAnswerCache.objects.filter(id=entry.id).update(hits=F("hits") + 1)
+    print(f"Answer cache hit with similarity {scores[best]:.4f}")
+    return entry.chat_message
+
+
+def store_cached_answer(project, key, embedding, chat_message):
+    ChatAnswerCache.objects.create(
+        project=project,
+        key=key,
+        embedding=np.asarray(embedding, dtype=np.float32).tobytes(),
+        chat_message=chat_message,
+    )
+    bump_answer_cache_version(project)
+
+
+def invalidate_answer_cache(project):
+    """Drops the cached answers of a project, e.g. after its documents changed."""
+    ChatAnswerCache.objects.filter(project=project).delete()
+    bump_answer_cache_version(project)
+
+
+def create_answer_from_cache(
+    cached_message,
+    chat,
+    match_number,
+    user_language,
+    temperature,
+    language,
+    tts_engine,
+    meta,
+    generate_audio=True,
+):
+    chat_message = ChatMessage.objects.create(
+        original_message=cached_message.original_message,
+        message=cached_message.message,
+        chat=chat,
+        messageType=ChatMessageType.AYUSHMA,
+        top_k=match_number,
+        temperature=temperature,
+        language=language,
+        meta=meta,
+    )
+    chat_message.reference_documents.set(cached_message.reference_documents.all())
+
+    # reuse the stored audio file instead of synthesizing and uploading it again
+    if cached_message.audio:
+        chat_message.audio = cached_message.audio.name
+        chat_message.save()
+    elif generate_audio:
+        speech_name = text_to_speech_file(
+            chat_message.message, user_language, tts_engine
+        )
+        if speech_name:
+            chat_message.audio = speech_name
+            chat_message.save()
+
+    return chat_message
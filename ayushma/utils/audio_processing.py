@@ -0,0 +1,234 @@
+import os
+import re
+import shutil
+import subprocess
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+SAMPLE_RATE = 16000
+PREPROCESSED_CONTENT_TYPE = "audio/ogg"
+
+# leading silence is dropped and longer pauses, including the trailing one, are
+# shortened. Works on the stream, the audio is never held in memory as a whole.
+SILENCE_FILTER = (
+    "silenceremove=start_periods=1:start_threshold={threshold}dB:start_silence=0.2"
+    ":stop_periods=-1:stop_duration=1:stop_threshold={threshold}dB:stop_silence=0.3"
+)
+
+
+def get_ffmpeg():
+    return shutil.which("ffmpeg")
+
+
+def write_chunks(audio, pipe):
+    try:
+        for chunk in audio.chunks():
+            pipe.write(chunk)
+    except BrokenPipeError:
+        # ffmpeg exited early, its error is reported by run_ffmpeg
+        pass
+    finally:
+        pipe.close()
+
+
+def run_ffmpeg(audio, args, input_args=None):
+    """Runs ffmpeg with an uploaded file as input, returns what it writes out."""
+    # uploads spooled to disk are read by ffmpeg directly, others are piped in
+    if hasattr(audio, "temporary_file_path"):
+        source, stdin = audio.temporary_file_path(), subprocess.DEVNULL
+    else:
+        source, stdin = "pipe:0", subprocess.PIPE
+
+    process = subprocess.Popen(
+        [get_ffmpeg(), "-hide_banner", "-loglevel", "error"]
+        + (input_args or [])
+        + ["-i", source]
+        + args
+        + ["pipe:1"],
+        stdin=stdin,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    writer = None
+    if stdin == subprocess.PIPE:
+        writer = threading.Thread(
+            target=write_chunks, args=(audio, process.stdin), daemon=True
+        )
+        writer.start()
+    output = process.stdout.read()
+    error = process.stderr.read()
+    process.wait()
+    if writer:
+        writer.join()
+    if process.returncode != 0:
+        raise Exception(f"[Audio] ffmpeg failed: {error.decode(errors='ignore')}")
+    return output
+
+
+def get_encode_args():
+    return [
+        "-c:a",
+        "libopus",
+        "-b:a",
+        settings.STT_BITRATE,
+        "-application",
+        "voip",
+        "-f",
+        "ogg",
+    ]
+
+
+def preprocess_audio(audio):
+    """
+    Decodes an uploaded recording, down-mixes it to mono 16 kHz, trims silence and
+    encodes it to ogg/opus, which is a fraction of the size of the usual uploads.
+    Returns the upload as it is if it cannot be processed.
+    """
+    if not settings.STT_PREPROCESS or not get_ffmpeg():
+        return audio
+
+    try:
+        output = run_ffmpeg(
+            audio,
+            [
+                "-vn",
+                "-ac",
+                "1",
+                "-ar",
+                str(SAMPLE_RATE),
+                "-af",
+                SILENCE_FILTER.format(threshold=settings.STT_SILENCE_THRESHOLD),
+            ]
+            + get_encode_args(),
+        )
+    except Exception as e:
+        print(f"Failed to preprocess audio, using the upload as it is: {e}")
+        output = None
+    audio.seek(0)
+    if not output:
+        return audio
+
+    name = os.path.splitext(os.path.basename(audio.name or "audio"))[0]
+    return SimpleUploadedFile(
+        f"{name}.ogg", output, content_type=PREPROCESSED_CONTENT_TYPE
+    )
+
+
+def decode_samples(audio):
+    """
+    Decodes a recording to 16 kHz mono 16 bit samples, with its silence trimmed
+    as preprocess_audio does.
+    """
+    filters = []
+    if settings.STT_PREPROCESS:
+        filters = [
+            "-af",
+            SILENCE_FILTER.format(threshold=settings.STT_SILENCE_THRESHOLD),
+        ]
+    output = run_ffmpeg(
+        audio, ["-vn", "-ac", "1", "-ar", str(SAMPLE_RATE)] + filters + ["-f", "s16le"]
+    )
+    audio.seek(0)
+    return np.frombuffer(output, dtype=np.int16)
+
+
+def encode_samples(samples, name):
+    pcm = SimpleUploadedFile(f"{name}.pcm", samples.tobytes())
+    output = run_ffmpeg(
+        pcm,
+        get_encode_args(),
+        input_args=["-f", "s16le", "-ar", str(SAMPLE_RATE), "-ac", "1"],
+    )
+    return SimpleUploadedFile(
+        f"{name}.ogg", output, content_type=PREPROCESSED_CONTENT_TYPE
+    )
+
+
+def find_split_points(samples, chunk_seconds, frame_seconds=0.1):
+    """
+    Sample offsets to split the audio at so no chunk is longer than
+    `chunk_seconds`. Each split is at the quietest frame of the last quarter
+    of the chunk, usually a pause between words.
+    """
+    frame = int(SAMPLE_RATE * frame_seconds)
+    frames = len(samples) // frame
+    energy = (
+        samples[: frames * frame].astype(np.float32).reshape(frames, frame) ** 2
+    ).mean(axis=1)
+
+    chunk = int(chunk_seconds / frame_seconds)
+    search = max(chunk // 4, 1)
+    points = []
+    position = 0
+    while frames - position > chunk:
+        start = position + chunk - search
+        position = start + int(np.argmin(energy[start : position + chunk])) + 1
+        points.append(position * frame)
+    return points
+
+
+def split_audio(audio):
+    """
+    Preprocesses a recording and splits it on pauses into chunks of at most
+    STT_CHUNK_SECONDS that overlap by STT_CHUNK_OVERLAP seconds. Short recordings
+    are yielded as the only chunk. The recording is decoded once and each chunk
+    is encoded from its samples, one at a time, so the first ones can be
+    transcribed while the rest are encoded.
+    """
+    if not settings.STT_CHUNK_SECONDS or not get_ffmpeg():
+        yield preprocess_audio(audio)
+        return
+    try:
+        samples = decode_samples(audio)
+    except Exception as e:
+        print(f"Failed to decode audio, transcribing it in one piece: {e}")
+        audio.seek(0)
+        yield audio
+        return
+    if len(samples) <= settings.STT_CHUNK_SECONDS * SAMPLE_RATE:
+        if not settings.STT_PREPROCESS:
+            yield audio
+            return
+        # the samples are the preprocessed recording, only the encoding is left
+        name = os.path.splitext(os.path.basename(audio.name or "audio"))[0]
+        try:
+            chunk = encode_samples(samples, name)
+        except Exception as e:
+            print(f"Failed to preprocess audio, using the upload as it is: {e}")
+            chunk = audio
+        yield chunk
+        return
+
+    bounds = (
+        [0] + find_split_points(samples, settings.STT_CHUNK_SECONDS) + [len(samples)]
+    )
+    overlap = int(settings.STT_CHUNK_OVERLAP * SAMPLE_RATE)
+    for i, (start, end) in enumerate(zip(bounds, bounds[1:])):
+        yield encode_samples(
+            samples[max(start - overlap, 0) : min(end + overlap, len(samples))],
+            f"chunk_{i}",
+        )
+
+
+def normalize_word(word):
+    return re.sub(r"\W", "", word).casefold()
+
+
+def merge_transcripts(transcript, text, max_overlap=12):
+    """
+    Appends the transcript of a chunk to the transcript so far, dropping the words
+    at its start that repeat the end of the previous chunk (the overlapping audio).
+    """
+    words = text.split()
+    if not transcript:
+        return " ".join(words)
+    previous = [normalize_word(word) for word in transcript.split()[-max_overlap:]]
+    current = [normalize_word(word) for word in words[:max_overlap]]
+    for size in range(min(len(previous), len(current)), 0, -1):
+        if previous[-size:] == current[:size]:
+            words = words[size:]
+            break
+    return " ".join([transcript] + words)
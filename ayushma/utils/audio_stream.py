@@ -0,0 +1,208 @@
+import asyncio
+import time
+from urllib.parse import urlencode
+from uuid import UUID, uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signing import Signer
+from django.http import FileResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare
+
+from ayushma.models import ChatMessage
+from ayushma.utils.speech_cache import find_stored_speech, save_speech
+
+# the stream is polled quickly while chunks arrive and backs off while they do not
+STREAM_POLL_DELAY = 0.05
+STREAM_MAX_POLL_DELAY = 0.5
+
+audio_url_signer = Signer(salt="ayushma.message_audio")
+
+
+def get_audio_stream_key(message_id, part):
+    return f"tts_audio:{message_id}:{part}"
+
+
+def get_audio_url(chat, message_id):
+    """
+    Absolute url of the audio of a message. It is signed, so audio elements, which
+    cannot send the auth headers of the api, can play it.
+    """
+    # chats of api keys are served by the orphan chat endpoints
+    if chat.api_key_id:
+        path = reverse(
+            "api:orphan_chat-message-audio",
+            kwargs={
+                "external_id": str(chat.external_id),
+                "message_external_id": str(message_id),
+            },
+        )
+    else:
+        path = reverse(
+            "api:chat-message-audio",
+            kwargs={
+                "project_external_id": str(chat.project.external_id),
+                "external_id": str(chat.external_id),
+                "message_external_id": str(message_id),
+            },
+        )
+    signature = audio_url_signer.signature(f"{chat.external_id}:{message_id}")
+    return f"{settings.API_URL.rstrip('/')}{path}?{urlencode({'signature': signature})}"
+
+
+def is_audio_url_signed(request, chat_external_id, message_id):
+    """Whether the request has the signature of `get_audio_url` for the message."""
+    signature = request.GET.get("signature")
+    if not signature:
+        return False
+    return constant_time_compare(
+        signature, audio_url_signer.signature(f"{chat_external_id}:{message_id}")
+    )
+
+
+class AudioStream:
+    """
+    MP3 of a message that is still being synthesised, published chunk by chunk in
+    the shared cache so any worker can serve it while it is generated.
+
+    The message is created with `message_id` once the answer is complete.
+    """
+
+    def __init__(self, chat):
+        self.chat = chat
+        self.message_id = uuid4()
+        self.url = get_audio_url(chat, self.message_id)
+        self.chunks = 0
+        self.closed = False
+        cache.set(
+            get_audio_stream_key(self.message_id, "chat"),
+            str(chat.external_id),
+            settings.TTS_STREAM_CACHE_TIMEOUT,
+        )
+
+    def write(self, chunk):
+        if self.closed or not chunk:
+            return
+        cache.set(
+            get_audio_stream_key(self.message_id, self.chunks),
+            chunk,
+            settings.TTS_STREAM_CACHE_TIMEOUT,
+        )
+        self.chunks += 1
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        cache.set(
+            get_audio_stream_key(self.message_id, "end"),
+            self.chunks,
+            settings.TTS_STREAM_CACHE_TIMEOUT,
+        )
+
+
+def audio_stream_exists(chat, message_id):
+    return cache.get(get_audio_stream_key(message_id, "chat")) == str(chat.external_id)
+
+
+def read_audio_stream(message_id):
+    """
+    Yields the chunks of an audio stream as they are published. Stops at the end
+    of the stream or after TTS_STREAM_TIMEOUT seconds without a new chunk.
+    """
+    part = 0
+    delay = STREAM_POLL_DELAY
+    deadline = time.time() + settings.TTS_STREAM_TIMEOUT
+    while True:
+        chunk = cache.get(get_audio_stream_key(message_id, part))
+        if chunk is not None:
+            yield chunk
+            part += 1
+            delay = STREAM_POLL_DELAY
+            deadline = time.time() + settings.TTS_STREAM_TIMEOUT
+            continue
+        end = cache.get(get_audio_stream_key(message_id, "end"))
+        if (end is not None and part >= end) or time.time() > deadline:
+            return
+        time.sleep(delay)
+        delay = min(delay * 2, STREAM_MAX_POLL_DELAY)
+
+
+async def aread_audio_stream(message_id):
+    """
+    Async version of read_audio_stream. ASGI buffers sync iterators, so this is
+    the only way the audio reaches the client while it is synthesised.
+    """
+    part = 0
+    delay = STREAM_POLL_DELAY
+    deadline = time.time() + settings.TTS_STREAM_TIMEOUT
+    while True:
+        chunk = await cache.aget(get_audio_stream_key(message_id, part))
+        if chunk is not None:
+            yield chunk
+            part += 1
+            delay = STREAM_POLL_DELAY
+            deadline = time.time() + settings.TTS_STREAM_TIMEOUT
+            continue
+        end = await cache.aget(get_audio_stream_key(message_id, "end"))
+        if (end is not None and part >= end) or time.time() > deadline:
+            return
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, STREAM_MAX_POLL_DELAY)
+
+
+def get_stream_audio(message_id):
+    """The whole audio of a finished stream, None if it is incomplete or expired."""
+    end = cache.get(get_audio_stream_key(message_id, "end"))
+    if end is None:
+        return None
+    keys = [get_audio_stream_key(message_id, part) for part in range(end)]
+    chunks = cache.get_many(keys)
+    if len(chunks) != len(keys):
+        return None
+    return b"".join(chunks[key] for key in keys)
+
+
+def get_message_audio_response(chat, message_id, asynchronous=False):
+    """
+    Returns the stored audio of a message, or its audio stream while it is being
+    synthesised. None if the message has no audio.
+    """
+    try:
+        message_id = UUID(str(message_id))
+    except ValueError:
+        return None
+
+    chat_message = (
+        ChatMessage.objects.filter(chat=chat, external_id=message_id)
+        .only("audio")
+        .first()
+    )
+    if chat_message and chat_message.audio:
+        return FileResponse(chat_message.audio.open("rb"), content_type="audio/mpeg")
+    if not audio_stream_exists(chat, message_id):
+        return None
+    return StreamingHttpResponse(
+        (
+            aread_audio_stream(message_id)
+            if asynchronous
+            else read_audio_stream(message_id)
+        ),
+        content_type="audio/mpeg",
+    )
+
+
+def save_message_audio(chat_message_id, message_id, speech_name):
+    """
+    Uploads the audio of a streamed message from its stream to the storage.
+    Returns False if the stream is no longer in the cache.
+    """
+    if not find_stored_speech(speech_name):
+        audio = get_stream_audio(message_id)
+        if audio is None:
+            return False
+        speech_name = save_speech(speech_name, audio)
+    # only the audio, the rest of the message may have been updated meanwhile
+    ChatMessage.objects.filter(id=chat_message_id).update(audio=speech_name)
+    return True
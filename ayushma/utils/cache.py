@@ -0,0 +1,143 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def hash_key(*parts) -> str:
+    return hashlib.sha256("\n".join(str(part) for part in parts).encode()).hexdigest()
+
+
+def is_cache_shared() -> bool:
+    """Whether other processes, e.g. celery workers, see what is put in the cache."""
+    return not isinstance(caches["default"], (LocMemCache, DummyCache))
+
+
+def normalize_text(text: str) -> str:
+    """Collapses whitespace and case so trivially different strings share a key."""
+    return " ".join(text.split()).casefold()
+
+
+class LRUCache:
+    """
+    Thread-safe in-process least recently used cache. `on_evict` is called with
+    the values dropped to keep it within `maxsize`.
+    """
+
+    def __init__(self, maxsize=1024, on_evict=None):
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.data:
+                return default
+            self.data.move_to_end(key)
+            return self.data[key]
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        evicted = []
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                evicted.append(self.data.popitem(last=False)[1])
+        if self.on_evict:
+            for value in evicted:
+                self.on_evict(value)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+class TieredCache:
+    """
+    In-process LRU in front of the shared django cache (redis in production).
+
+    Values must be picklable; keys are namespaced with `prefix`. Values that are
+    unlikely to be read again can be kept out of the shared cache with
+    `shared=False`.
+    """
+
+    def __init__(self, prefix, maxsize=1024, timeout=None):
+        self.prefix = prefix
+        self.timeout = timeout
+        self.local = LRUCache(maxsize)
+
+    def make_key(self, key):
+        return f"{self.prefix}:{key}"
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            return value
+        try:
+            value = cache.get(self.make_key(key))
+        except Exception as e:
+            print(f"Error reading from cache: {e}")
+            return None
+        if value is not None:
+            self.local.set(key, value)
+        return value
+
+    def get_many(self, keys, shared=True):
+        values = {}
+        missing = []
+        for key in keys:
+            value = self.local.get(key)
+            if value is None:
+                missing.append(key)
+            else:
+                values[key] = value
+        if not missing or not shared:
+            return values
+        try:
+            shared = cache.get_many([self.make_key(key) for key in missing])
+        except Exception as e:
+            print(f"Error reading from cache: {e}")
+            return values
+        for key in missing:
+            value = shared.get(self.make_key(key))
+            if value is not None:
+                self.local.set(key, value)
+                values[key] = value
+        return values
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        try:
+            cache.set(self.make_key(key), value, self.timeout)
+        except Exception as e:
+            print(f"Error writing to cache: {e}")
+
+    def set_many(self, values, shared=True):
+        for key, value in values.items():
+            self.local.set(key, value)
+        if not shared:
+            return
+        try:
+            cache.set_many(
+                {self.make_key(key): value for key, value in values.items()},
+                self.timeout,
+            )
+        except Exception as e:
+            print(f"Error writing to cache: {e}")
+
+    def delete(self, key):
+        self.local.delete(key)
+        try:
+            cache.delete(self.make_key(key))
+        except Exception as e:
+            print(f"Error deleting from cache: {e}")
@@ -0,0 +1,185 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import tiktoken
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from langchain.schema import AIMessage, HumanMessage, SystemMessage
+
+from ayushma.models import ChatMessage
+from ayushma.models.enums import ChatMessageType, ModelType
+from ayushma.utils.langchain import get_model_context_size, get_model_name
+from ayushma.utils.openai_client import get_openai_client
+
+# chat summaries are updated after the response in a bounded pool, at most one
+# queued per chat
+summary_executor = ThreadPoolExecutor(
+    max_workers=settings.CHAT_HISTORY_SUMMARY_WORKERS,
+    thread_name_prefix="chat_summary",
+)
+pending_summaries = set()
+pending_summaries_lock = threading.Lock()
+
+SUMMARY_PROMPT = (
+    "Summarise the conversation below between a user and an assistant in a few "
+    "sentences. Keep the medical details, names and numbers the user might refer "
+    "to later."
+)
+
+
+@lru_cache(maxsize=None)
+def get_model_encoding(model_name):
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def get_history_token_budget(model_name):
+    # leave most of the context window to the prompt, references and the answer
+    return min(
+        settings.CHAT_HISTORY_MAX_TOKENS, get_model_context_size(model_name) // 4
+    )
+
+
+def get_history_queryset(chat, exclude_id):
+    """Most recent messages first, at most CHAT_HISTORY_MAX_MESSAGES of them."""
+    return (
+        ChatMessage.objects.filter(
+            chat=chat,
+            messageType__in=[ChatMessageType.USER, ChatMessageType.AYUSHMA],
+        )
+        .exclude(id=exclude_id)
+        .only("id", "message", "messageType")
+        .order_by("-created_at")[: settings.CHAT_HISTORY_MAX_MESSAGES]
+    )
+
+
+def build_chat_history(chat, recent_messages, model):
+    """
+    Returns the langchain messages of the most recent messages that fit in the
+    history token budget of the model, oldest first, and the id of the oldest
+    message included if older messages were left out (None otherwise).
+    """
+    model_name = get_model_name(model or ModelType.GPT_3_5)
+    encoding = get_model_encoding(model_name)
+    budget = get_history_token_budget(model_name)
+
+    chat_history = []
+    tokens = 0
+    truncated = len(recent_messages) >= settings.CHAT_HISTORY_MAX_MESSAGES
+    for message in recent_messages:
+        if message.messageType == ChatMessageType.USER:
+            history_message = HumanMessage(content=f"{message.message}")
+        else:
+            history_message = AIMessage(content=f"Ayushma: {message.message}")
+        # every message costs a few tokens of formatting besides its content
+        message_tokens = len(encoding.encode(history_message.content)) + 4
+        if tokens + message_tokens > budget:
+            truncated = True
+            break
+        chat_history.append((message.id, history_message))
+        tokens += message_tokens
+    chat_history.reverse()
+
+    # messages older than the boundary are not part of the history
+    boundary_id = None
+    if truncated:
+        boundary_id = chat_history[0][0] if chat_history else recent_messages[0].id + 1
+
+    messages = [history_message for _, history_message in chat_history]
+    if boundary_id and settings.CHAT_HISTORY_SUMMARY:
+        summary = cache.get(f"chat_history_summary:{chat.id}")
+        if summary:
+            messages.insert(
+                0,
+                SystemMessage(
+                    content=f"Summary of the earlier conversation: {summary['summary']}"
+                ),
+            )
+    return messages, boundary_id
+
+
+def get_chat_history(chat, exclude_id, model):
+    return build_chat_history(chat, list(get_history_queryset(chat, exclude_id)), model)
+
+
+async def aget_chat_history(chat, exclude_id, model):
+    recent_messages = [
+        message async for message in get_history_queryset(chat, exclude_id)
+    ]
+    return build_chat_history(chat, recent_messages, model)
+
+
+def update_chat_summary(chat_id, boundary_id, openai_key, model):
+    """
+    Folds the messages older than `boundary_id` that are not summarised yet into
+    the cached summary of the chat. Runs after the response was sent.
+    """
+    key = f"chat_history_summary:{chat_id}"
+    summary = cache.get(key) or {"until": 0, "summary": ""}
+    try:
+        summarize_messages(key, summary, chat_id, boundary_id, openai_key, model)
+    except Exception as e:
+        print(f"Error summarising chat history: {e}")
+    finally:
+        with pending_summaries_lock:
+            pending_summaries.discard(chat_id)
+        # this runs in its own thread, which has its own database connection
+        connection.close()
+
+
+def summarize_messages(key, summary, chat_id, boundary_id, openai_key, model):
+    messages = list(
+        ChatMessage.objects.filter(
+            chat_id=chat_id,
+            id__gt=summary["until"],
+            id__lt=boundary_id,
+            messageType__in=[ChatMessageType.USER, ChatMessageType.AYUSHMA],
+        )
+        .only("id", "message", "messageType")
+        .order_by("id")
+    )
+    if not messages:
+        return
+
+    conversation = "\n".join(
+        f"{'User' if message.messageType == ChatMessageType.USER else 'Assistant'}: "
+        f"{message.message}"
+        for message in messages
+    )
+    if summary["summary"]:
+        conversation = f"Summary so far: {summary['summary']}\n\n{conversation}"
+
+    client = get_openai_client(openai_key)
+    response = client.chat.completions.create(
+        model=get_model_name(model or ModelType.GPT_3_5),
+        messages=[
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": conversation},
+        ],
+        temperature=0,
+    )
+    cache.set(
+        key,
+        {"until": messages[-1].id, "summary": response.choices[0].message.content},
+        settings.CHAT_HISTORY_SUMMARY_TIMEOUT,
+    )
+
+
+def schedule_chat_summary(chat, boundary_id, openai_key, model):
+    if not boundary_id or not settings.CHAT_HISTORY_SUMMARY:
+        return
+    # the summary is requested with the OpenAI client, which has no Azure support
+    if settings.OPENAI_API_TYPE == "azure":
+        return
+    with pending_summaries_lock:
+        # one summary per chat at a time, the next question picks up what it missed
+        if chat.id in pending_summaries:
+            return
+        pending_summaries.add(chat.id)
+    summary_executor.submit(
+        update_chat_summary, chat.id, boundary_id, openai_key, model
+    )
@@ -0,0 +1,134 @@
+import re
+from functools import lru_cache
+from typing import List
+
+import tiktoken
+from django.conf import settings
+
+
+@lru_cache(maxsize=None)
+def get_encoding():
+    return tiktoken.encoding_for_model("text-embedding-ada-002")
+
+
+heading_pattern = re.compile(r"^(#{1,6}\s|\d+(\.\d+)+\s+[A-Z])")
+
+
+def is_heading(line: str) -> bool:
+    return bool(heading_pattern.match(line))
+
+
+def chunk_lines(text: str) -> List[str]:
+    """Every non-blank line is a chunk."""
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+
+def split_paragraphs(text: str) -> List[List[str]]:
+    """Splits text into paragraphs (lists of lines) on blank lines and headings."""
+    paragraphs = []
+    current = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or is_heading(line):
+            if current:
+                paragraphs.append(current)
+            current = []
+        if line:
+            current.append(line)
+    if current:
+        paragraphs.append(current)
+    return paragraphs
+
+
+def chunk_tokens(
+    text: str, chunk_size: int = None, chunk_overlap: int = None
+) -> List[str]:
+    """
+    Packs paragraphs into chunks of up to `chunk_size` tokens. Paragraphs that are
+    too long are packed line by line, and lines that are too long are split on
+    token boundaries. A heading always starts a new chunk and is kept with the
+    text that follows it. Consecutive chunks of a section share the last
+    `chunk_overlap` tokens of the previous chunk.
+    """
+    chunk_size = chunk_size or settings.CHUNK_SIZE
+    chunk_overlap = min(
+        settings.CHUNK_OVERLAP if chunk_overlap is None else chunk_overlap,
+        chunk_size // 2,
+    )
+
+    encoding = get_encoding()
+    chunks = []
+    pieces = []  # (text, tokens, is heading) of the chunk being built
+    size = 0
+    carried = 0  # leading pieces carried over from the previous chunk
+
+    def flush(overlap=True, hold_headings=True):
+        nonlocal pieces, size, carried
+        content = pieces[carried:]
+        # a heading waits for the text that follows it
+        if hold_headings and content and all(heading for _, _, heading in content):
+            pieces, size, carried = content, sum(t for _, t, _ in content), 0
+            return
+
+        chunk = "\n".join(piece for piece, _, _ in pieces)
+        pieces, size, carried = [], 0, 0
+        # a chunk made only of carried over text would be a duplicate
+        if not content:
+            return
+        chunks.append(chunk)
+        if overlap and chunk_overlap:
+            tail = encoding.encode(chunk)[-chunk_overlap:]
+            pieces.append((encoding.decode(tail), len(tail), False))
+            size, carried = len(tail), 1
+
+    def add(piece, tokens, heading=False):
+        nonlocal pieces, size, carried
+        if size + len(tokens) > chunk_size:
+            flush()
+            if carried and size + len(tokens) > chunk_size >= len(tokens):
+                # keep the piece whole rather than the overlap
+                pieces, size, carried = [], 0, 0
+
+        while size + len(tokens) > chunk_size:
+            # fill the rest of the chunk with the start of the piece
+            room = chunk_size - size
+            if room > 0:
+                pieces.append((encoding.decode(tokens[:room]), room, False))
+                tokens = tokens[room:]
+                piece = encoding.decode(tokens)
+            flush(hold_headings=False)
+        pieces.append((piece, len(tokens), heading))
+        size += len(tokens)
+
+    for paragraph in split_paragraphs(text):
+        if is_heading(paragraph[0]):
+            flush(overlap=False)
+
+        paragraph_text = "\n".join(paragraph)
+        tokens = encoding.encode(paragraph_text)
+        if len(tokens) <= chunk_size:
+            add(
+                paragraph_text, tokens, len(paragraph) == 1 and is_heading(paragraph[0])
+            )
+            continue
+
+        for line in paragraph:
+            add(line, encoding.encode(line), is_heading(line))
+
+    flush(overlap=False, hold_headings=False)
+    return chunks
+
+
+chunkers = {
+    "line": chunk_lines,
+    "token": chunk_tokens,
+    # Add new chunkers here
+}
+
+
+def chunk_text(text: str, strategy: str = None) -> List[str]:
+    strategy = strategy or settings.DOCUMENT_CHUNKER
+    chunker = chunkers.get(strategy)
+    if not chunker:
+        raise ValueError(f"Invalid document chunker: {strategy}")
+    return chunker(text)
@@ -1,6 +1,7 @@
 import time
 
 from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
 from django.http import StreamingHttpResponse
 from rest_framework import status
 from rest_framework.response import Response
@@ -9,7 +10,7 @@ from ayushma.models import APIKey, ChatMessage
 from ayushma.models.services import Service
 from ayushma.serializers import ChatMessageSerializer
 from ayushma.utils.language_helpers import translate_text
-from ayushma.utils.openaiapi import converse, converse_thread
+from ayushma.utils.openaiapi import aconverse, converse, converse_thread
 from ayushma.utils.speech_to_text import speech_to_text
 
 
@@ -163,7 +164,11 @@ def converse_api(
 
     if stream:
         response = StreamingHttpResponse(content_type="text/event-stream")
-        response.streaming_content = converse(
+        # under ASGI the stream is driven natively on the event loop
+        stream_converse = (
+            aconverse if isinstance(request._request, ASGIRequest) else converse
+        )
+        response.streaming_content = stream_converse(
             english_text=english_text,
             local_translated_text=translated_text,
             openai_key=open_ai_key,
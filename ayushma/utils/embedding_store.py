@@ -0,0 +1,81 @@
+import hashlib
+from typing import Callable, List, Optional
+
+import numpy as np
+from django.conf import settings
+
+from ayushma.models.embedding import StoredEmbedding
+from ayushma.utils.openaiapi import get_embedding
+
+
+def get_embedding_model(model):
+    if settings.OPENAI_API_TYPE == "azure":
+        return settings.AZURE_EMBEDDING_DEPLOYMENT
+    return model
+
+
+def get_text_hash(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def get_stored_embedding(
+    text: List[str],
+    model: str = "text-embedding-ada-002",
+    openai_api_key: str = settings.OPENAI_API_KEY,
+    before_request: Optional[Callable[[List[str]], None]] = None,
+) -> List[List[float]]:
+    """
+    Same as `get_embedding`, but texts that were embedded before with the same model
+    are read from the embedding store, and new embeddings are added to it. Used
+    when upserting documents so re-indexing does not embed unchanged text again.
+
+    `before_request` is called with the texts that are not stored right before
+    they are sent to the API, e.g. to rate limit the requests.
+    """
+    if not settings.EMBEDDING_STORE:
+        if before_request:
+            before_request(text)
+        return get_embedding(text, model=model, openai_api_key=openai_api_key)
+
+    stored_model = get_embedding_model(model)
+    hashes = [get_text_hash(item) for item in text]
+
+    stored = {}
+    for i in range(0, len(hashes), 1000):
+        stored.update(
+            StoredEmbedding.objects.filter(
+                model=stored_model, text_hash__in=hashes[i : i + 1000]
+            ).values_list("text_hash", "embedding")
+        )
+
+    missing = {
+        text_hash: item
+        for text_hash, item in zip(hashes, text)
+        if text_hash not in stored
+    }
+    if missing:
+        if before_request:
+            before_request(list(missing.values()))
+        embeddings = get_embedding(
+            list(missing.values()), model=model, openai_api_key=openai_api_key
+        )
+        fetched = {
+            text_hash: np.asarray(embedding, dtype=np.float32).tobytes()
+            for text_hash, embedding in zip(missing.keys(), embeddings)
+        }
+        StoredEmbedding.objects.bulk_create(
+            [
+                StoredEmbedding(
+                    model=stored_model, text_hash=text_hash, embedding=embedding
+                )
+                for text_hash, embedding in fetched.items()
+            ],
+            ignore_conflicts=True,
+        )
+        stored.update(fetched)
+
+    print(f"{len(text) - len(missing)} of {len(text)} embeddings read from the store")
+    return [
+        np.frombuffer(bytes(stored[text_hash]), dtype=np.float32).tolist()
+        for text_hash in hashes
+    ]
@@ -0,0 +1,125 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from ayushma.utils.language_helpers import (
+    split_sentences,
+    text_to_speech,
+    translate_text,
+)
+from core.settings.base import AI_NAME
+
+# shorter sentences are synthesised together with the next one
+MIN_SEGMENT_LENGTH = 60
+
+# the answer ends with the ids of its reference documents, which are not read
+# out (see add_reference_documents)
+REFERENCES_MARKER = "References:"
+
+tts_executor = ThreadPoolExecutor(
+    max_workers=settings.TTS_WORKERS, thread_name_prefix="tts"
+)
+
+
+def synthesize_segment(text, user_language, tts_engine):
+    """Returns the translated segment, keeping its surrounding whitespace, and its audio."""
+    content = text.strip()
+    if not content:
+        return text, None
+    leading = text[: len(text) - len(text.lstrip())]
+    trailing = text[len(text.rstrip()) :]
+
+    translated = content
+    if user_language != "en-IN":
+        translated = translate_text(user_language, content)
+    audio = None
+    if tts_engine:
+        audio = text_to_speech(translated, user_language, tts_engine)
+    return leading + translated + trailing, audio
+
+
+class IncrementalSpeech:
+    """
+    Translates and synthesises a streamed answer sentence by sentence while the
+    rest of it is still being generated, so the audio is ready about a sentence
+    after the last token. The audio of each segment is written to `audio_stream`
+    in order as soon as it is synthesised.
+    """
+
+    def __init__(self, user_language, tts_engine, audio_stream=None):
+        self.user_language = user_language
+        self.tts_engine = tts_engine
+        self.audio_stream = audio_stream
+        self.buffer = ""
+        self.ended = False
+        self.segments = []
+        self.published = 0
+        self.lock = threading.Lock()
+        self.start_time = None
+
+    def feed(self, token):
+        if self.ended:
+            return
+        self.buffer += token
+        references = self.buffer.find(REFERENCES_MARKER)
+        if references != -1:
+            self.buffer = self.buffer[:references]
+            self.ended = True
+        sentences, self.buffer = split_sentences(self.buffer, MIN_SEGMENT_LENGTH)
+        for sentence in sentences:
+            self.submit(sentence)
+
+    def submit(self, text):
+        # same clean up as the full response gets in converse
+        text = text.replace(f"{AI_NAME}:", "")
+        if not self.segments:
+            text = text.lstrip()
+        if self.start_time is None:
+            self.start_time = time.time()
+        segment = tts_executor.submit(
+            synthesize_segment, text, self.user_language, self.tts_engine
+        )
+        self.segments.append(segment)
+        if self.audio_stream:
+            segment.add_done_callback(self.publish)
+
+    def publish(self, _segment=None):
+        # segments finish out of order, write the ones done in front of the stream
+        with self.lock:
+            while (
+                self.published < len(self.segments)
+                and self.segments[self.published].done()
+            ):
+                segment = self.segments[self.published]
+                if not segment.cancelled() and not segment.exception():
+                    self.audio_stream.write(segment.result()[1])
+                self.published += 1
+
+    def finish(self, stats):
+        """Waits for the remaining segments, returns the translated text and the audio."""
+        if self.buffer:
+            self.submit(self.buffer)
+            self.buffer = ""
+        results = [segment.result() for segment in self.segments]
+        end_time = time.time()
+        if self.audio_stream:
+            self.publish()
+            self.audio_stream.close()
+
+        stats["response_translation_start_time"] = self.start_time
+        stats["response_translation_end_time"] = end_time
+        stats["tts_start_time"] = self.start_time
+        stats["tts_end_time"] = end_time
+
+        text = "".join(segment_text for segment_text, _ in results).strip()
+        # mp3 is a sequence of self-contained frames, the segments can be appended
+        audio = b"".join(segment_audio for _, segment_audio in results if segment_audio)
+        return text, audio
+
+    def cancel(self):
+        for segment in self.segments:
+            segment.cancel()
+        if self.audio_stream:
+            self.audio_stream.close()
@@ -1,8 +1,8 @@
+import asyncio
 from typing import Any, Literal
 
 import openai
 from django.conf import settings
-from langchain.callbacks.manager import AsyncCallbackManager
 from langchain.chains import LLMChain
 from langchain.chat_models import ChatOpenAI
 from langchain.llms import AzureOpenAI
@@ -17,6 +17,8 @@ from langchain.schema import SystemMessage
 from langchain.schema.messages import HumanMessage
 
 from ayushma.models.enums import ModelType
+from ayushma.utils.cache import LRUCache, hash_key
+from ayushma.utils.openai_client import get_async_openai_client, get_openai_client
 from ayushma.utils.stream_callback import StreamingQueueCallbackHandler
 from core.settings.base import AI_NAME
 from utils.helpers import get_base64_document
@@ -50,6 +52,19 @@ def get_model_name(model_type: ModelType):
         return "gpt-3.5-turbo"
 
 
+def get_model_context_size(model_name: str) -> int:
+    """Returns the number of tokens that fit in the context window of a model."""
+    if model_name.startswith(("gpt-4o", "gpt-4-turbo", "gpt-4-vision")):
+        return 128000
+    elif model_name.startswith("gpt-4-32k"):
+        return 32768
+    elif model_name.startswith("gpt-4"):
+        return 8192
+    elif model_name.startswith(("gpt-3.5", "gpt-35-turbo-16k")):
+        return 16384
+    return 4096
+
+
 class GenericHumanMessage(HumanMessage):
     """A Generic Message from a human."""
 
@@ -80,6 +95,15 @@ class GenericHumanMessagePromptTemplate(BaseStringMessagePromptTemplate):
         )
 
 
+# compiled chains by api key, model, prompt, temperature and event loop
+chains = LRUCache(maxsize=64)
+
+# what the default prompt answers when the references do not cover the query
+NO_ANSWER_REPLY = (
+    "Sorry I am not able to find anything related to your query in my database"
+)
+
+
 class LangChainHelper:
     def __init__(
         self,
@@ -88,30 +112,7 @@ class LangChainHelper:
         prompt_template=None,
         temperature=0.1,
         stream=True,
-        token_queue=None,
-        end=None,
-        error=None,
     ):
-        llm_args = {
-            "temperature": temperature,  # 0 means more deterministic output, 1 means more random output
-            "openai_api_key": openai_api_key,
-            "model_name": get_model_name(model),
-            "request_timeout": 180,
-            "max_tokens": "4096",
-        }
-        if stream:
-            llm_args["streaming"] = True
-            llm_args["callback_manager"] = AsyncCallbackManager(
-                [StreamingQueueCallbackHandler(token_queue, end, error)]
-            )
-
-        if settings.OPENAI_API_TYPE == "azure":
-            llm_args["deployment_name"] = settings.AZURE_CHAT_DEPLOYMENT
-            llm_args["openai_api_version"] = openai.api_version
-            llm = AzureOpenAI(**llm_args)
-        else:
-            llm = ChatOpenAI(**llm_args)
-
         template = f"""You are an assistant called {AI_NAME} who understands all languages and repsonds only in english and you must follow the given algorithm strictly to assist users. Remember you must give accurate answers, so stick strictly to the references as explained in algorithm. Your output must be in markdown format find important terms and add bold to it (example **word**) find numbers and add italic to it(example *word*) add bullet points to a list(example -word1\n-word2):
 Algorithm:
 references = {{reference}}
@@ -129,7 +130,7 @@ result = <analyze "references", chat history with user and user's current query
 )
 else:
 (
-result = <"Sorry I am not able to find anything related to your query in my database">
+result = <"{NO_ANSWER_REPLY}">
 
 Output Format (follow the below format strictly and you must provide the references ids array in all your responses after the result. Do not mention about the references anywhere else):
 '''
@@ -144,6 +145,51 @@ References: <array of reference_ids (in the format: [1,2,3]) "include all the re
                 "Validation Error: Prompt template must contain {reference} variable"
             )
 
+        try:
+            # the async client of a chain can only be used from the loop it was made in
+            loop_id = id(asyncio.get_running_loop())
+        except RuntimeError:
+            loop_id = None
+        key = hash_key(openai_api_key, model, template, temperature, stream, loop_id)
+        self.chain = chains.get(key)
+        if self.chain is None or self.has_stale_clients(openai_api_key):
+            self.chain = self.build_chain(
+                openai_api_key, model, template, temperature, stream
+            )
+            chains.set(key, self.chain)
+
+    def has_stale_clients(self, openai_api_key):
+        # clients dropped from the shared client cache are closed
+        llm = self.chain.llm
+        return isinstance(llm, ChatOpenAI) and (
+            llm.client is not get_openai_client(openai_api_key).chat.completions
+            or llm.async_client
+            is not get_async_openai_client(openai_api_key).chat.completions
+        )
+
+    def build_chain(self, openai_api_key, model, template, temperature, stream):
+        llm_args = {
+            "temperature": temperature,  # 0 means more deterministic output, 1 means more random output
+            "openai_api_key": openai_api_key,
+            "model_name": get_model_name(model),
+            "request_timeout": 180,
+            "max_tokens": "4096",
+        }
+        if stream:
+            llm_args["streaming"] = True
+
+        if settings.OPENAI_API_TYPE == "azure":
+            llm_args["deployment_name"] = settings.AZURE_CHAT_DEPLOYMENT
+            llm_args["openai_api_version"] = openai.api_version
+            llm = AzureOpenAI(**llm_args)
+        else:
+            # share the pooled clients instead of opening new connections per chain
+            llm_args["client"] = get_openai_client(openai_api_key).chat.completions
+            llm_args["async_client"] = get_async_openai_client(
+                openai_api_key
+            ).chat.completions
+            llm = ChatOpenAI(**llm_args)
+
         system_prompt = PromptTemplate(template=template, input_variables=["reference"])
         system_message_prompt = SystemMessagePromptTemplate(
             prompt=system_prompt,
@@ -167,7 +213,7 @@ References: <array of reference_ids (in the format: [1,2,3]) "include all the re
             ]
         )
 
-        self.chain = LLMChain(llm=llm, prompt=chat_prompt, verbose=True)
+        return LLMChain(llm=llm, prompt=chat_prompt, verbose=settings.LANGCHAIN_VERBOSE)
 
     async def get_aresponse(
         self, job_done, error, token_queue, user_msg, reference, chat_history, documents
@@ -192,17 +238,27 @@ References: <array of reference_ids (in the format: [1,2,3]) "include all the re
 
         chat_history.append(SystemMessage(content=system_message))
 
+        # the chain is shared between requests, stream this response to its queue
+        handler = StreamingQueueCallbackHandler(
+            token_queue,
+            job_done,
+            error,
+            flush_interval=settings.STREAM_FLUSH_INTERVAL,
+            flush_size=settings.STREAM_FLUSH_SIZE,
+        )
+
         try:
             async_response = await self.chain.apredict(
+                callbacks=[handler],
                 user_msg=user_message,
                 reference=reference,
                 chat_history=chat_history,
             )
-            token_queue.put((job_done,))
+            token_queue.put_nowait((job_done,))
             return async_response
         except Exception as e:
             print(e)
-            token_queue.put((error, e))
+            token_queue.put_nowait((error, e))
 
     def get_response(self, user_msg, reference, chat_history, documents):
         system_message = "Remember to only answer the question if it can be answered with the given references"
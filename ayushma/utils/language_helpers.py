@@ -1,23 +1,61 @@
 import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 from django.conf import settings
 from google.cloud import texttospeech
 from google.cloud import translate_v2 as translate
-from openai import OpenAI
 from rest_framework.exceptions import APIException
 
 from ayushma.models.enums import TTSEngine
-
-
-def translate_text(target, text):
+from ayushma.utils.cache import TieredCache, hash_key
+from ayushma.utils.openai_client import get_openai_client
+
+# translations are kept in process, only the ones of texts that are translated
+# again and again, e.g. error messages, are shared between workers
+translation_cache = TieredCache(
+    "translation",
+    maxsize=settings.TRANSLATION_CACHE_SIZE,
+    timeout=settings.TRANSLATION_CACHE_TIMEOUT,
+)
+
+# segments the translation api accepts in one request
+TRANSLATION_MAX_SEGMENTS = 128
+
+
+@lru_cache(maxsize=None)
+def get_translate_client():
+    return translate.Client()
+
+
+def translate_texts(target, texts, shared=False):
+    """
+    Translates a list of texts with one request for the ones not cached yet.
+    `shared` keeps the translations in the shared cache as well, for texts that
+    will be translated again by other workers.
+    """
+    keys = [hash_key(target, text) for text in texts]
+    cached = translation_cache.get_many(set(keys), shared=shared)
+    missing = list({text: key for text, key in zip(texts, keys) if key not in cached})
     try:
-        translate_client = translate.Client()
-
-        result = translate_client.translate(text, target_language=target)
-        return result["translatedText"]
+        translate_client = get_translate_client()
+        for i in range(0, len(missing), TRANSLATION_MAX_SEGMENTS):
+            batch = missing[i : i + TRANSLATION_MAX_SEGMENTS]
+            results = translate_client.translate(batch, target_language=target)
+            translated = {
+                hash_key(target, text): result["translatedText"]
+                for text, result in zip(batch, results)
+            }
+            translation_cache.set_many(translated, shared=shared)
+            cached.update(translated)
     except Exception as e:
         print(f"Translation failed: {e}")
         raise APIException("[Translation] Failed to translate the text")
+    return [cached[key] for key in keys]
+
+
+def translate_text(target, text, shared=False):
+    return translate_texts(target, [text], shared=shared)[0]
 
 
 language_code_voice_map = {
@@ -34,6 +72,38 @@ language_code_voice_map = {
 }
 
 
+# a sentence ends with punctuation (including the devanagari danda) followed by
+# whitespace, or at a line break
+sentence_end = re.compile(r"(?<=[.!?\u0964])\s+|\n\s*")
+
+
+def split_sentences(text, min_length=0):
+    """
+    Splits the complete sentences off `text`, each with its trailing whitespace.
+    Sentences shorter than `min_length` are joined with the next one. Returns the
+    sentences and the incomplete rest of the text.
+    """
+    sentences = []
+    start = 0
+    for match in sentence_end.finditer(text):
+        if match.end() - start >= min_length:
+            sentences.append(text[start : match.end()])
+            start = match.end()
+    return sentences, text[start:]
+
+
+# longest input of one synthesis request
+tts_max_input = {
+    TTSEngine.GOOGLE: 5000,
+    TTSEngine.OPENAI: 4096,
+    # Add new engines here
+}
+
+tts_segment_executor = ThreadPoolExecutor(
+    max_workers=settings.TTS_SEGMENT_WORKERS, thread_name_prefix="tts_segment"
+)
+
+
 def sanitize_text(text):
     sanitized_text = re.sub(r"(\*\*|__)(.*?)\1", r"\2", text)  # Remove bold
     sanitized_text = re.sub(r"(\*|_)(.*?)\1", r"\2", sanitized_text)  # Remove italic
@@ -41,44 +111,129 @@ def sanitize_text(text):
     return sanitized_text
 
 
+def get_tts_language_code(language_code):
+    # in en-IN neural voice is not available
+    if language_code == "en-IN":
+        return "en-US"
+    return language_code
+
+
+def get_tts_voice(language_code, service):
+    if service == TTSEngine.GOOGLE:
+        return language_code_voice_map.get(get_tts_language_code(language_code))
+    if service == TTSEngine.OPENAI:
+        return "tts-1-hd/nova"
+    return None
+
+
+@lru_cache(maxsize=None)
+def get_tts_client():
+    return texttospeech.TextToSpeechClient()
+
+
+def get_tts_input_length(text, service):
+    # google limits the input in bytes, openai in characters
+    if service == TTSEngine.GOOGLE:
+        return len(text.encode())
+    return len(text)
+
+
+def split_words(text, max_length, service):
+    """Splits a sentence that is too long for one request between words."""
+    pieces = []
+    current = ""
+    for word in text.split(" "):
+        # a word that does not fit anywhere is cut, 4 bytes per character at most
+        while get_tts_input_length(word, service) > max_length:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(word[: max_length // 4])
+            word = word[max_length // 4 :]
+        candidate = f"{current} {word}" if current else word
+        if get_tts_input_length(candidate, service) > max_length:
+            pieces.append(current)
+            candidate = word
+        current = candidate
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_speech_text(text, service):
+    """
+    Packs the sentences of `text` into segments of at most TTS_SEGMENT_LENGTH,
+    and never more than the engine accepts in one request.
+    """
+    max_length = min(settings.TTS_SEGMENT_LENGTH, tts_max_input[service])
+    sentences, rest = split_sentences(text)
+    segments = []
+    current = ""
+    for sentence in sentences + [rest]:
+        if get_tts_input_length(current + sentence, service) <= max_length:
+            current += sentence
+            continue
+        segments.append(current)
+        current = ""
+        if get_tts_input_length(sentence, service) <= max_length:
+            current = sentence
+        else:
+            segments += split_words(sentence, max_length, service)
+    segments.append(current)
+    return [segment.strip() for segment in segments if segment.strip()]
+
+
+def synthesize_speech(text, language_code, service):
+    """Synthesises text that fits in one request of the engine."""
+    if service == TTSEngine.GOOGLE:
+        client = get_tts_client()
+
+        synthesis_input = texttospeech.SynthesisInput(text=text)
+
+        voice = texttospeech.VoiceSelectionParams(
+            language_code=language_code,
+            name=language_code_voice_map[language_code],
+        )
+        audio_config = texttospeech.AudioConfig(
+            audio_encoding=texttospeech.AudioEncoding.MP3
+        )
+
+        response = client.synthesize_speech(
+            input=synthesis_input,
+            voice=voice,
+            audio_config=audio_config,
+        )
+
+        return response.audio_content
+    elif service == TTSEngine.OPENAI:
+        client = get_openai_client()
+        response = client.audio.speech.create(
+            model="tts-1-hd",
+            voice="nova",
+            input=text,
+        )
+        return response.read()
+
+
 def text_to_speech(text, language_code, service):
     try:
-        # in en-IN neural voice is not available
-        if language_code == "en-IN":
-            language_code = "en-US"
+        language_code = get_tts_language_code(language_code)
 
         text = sanitize_text(text)
 
-        if service == TTSEngine.GOOGLE:
-            client = texttospeech.TextToSpeechClient()
-
-            synthesis_input = texttospeech.SynthesisInput(text=text)
-
-            voice = texttospeech.VoiceSelectionParams(
-                language_code=language_code,
-                name=language_code_voice_map[language_code],
-            )
-            audio_config = texttospeech.AudioConfig(
-                audio_encoding=texttospeech.AudioEncoding.MP3
-            )
-
-            response = client.synthesize_speech(
-                input=synthesis_input,
-                voice=voice,
-                audio_config=audio_config,
-            )
-
-            return response.audio_content
-        elif service == TTSEngine.OPENAI:
-            client = OpenAI(api_key=settings.OPENAI_API_KEY)
-            response = client.audio.speech.create(
-                model="tts-1-hd",
-                voice="nova",
-                input=text,
-            )
-            return response.read()
-        else:
+        if service not in tts_max_input:
             raise APIException("[Text to Speech] Service not supported.")
+
+        # long texts are synthesised in segments, concurrently
+        segments = split_speech_text(text, service)
+        if len(segments) <= 1:
+            return synthesize_speech(text, language_code, service)
+        audio = tts_segment_executor.map(
+            lambda segment: synthesize_speech(segment, language_code, service),
+            segments,
+        )
+        # mp3 is a sequence of self-contained frames, the segments can be appended
+        return b"".join(audio)
     except Exception as e:
         print(f"Failed to convert text to speech: {e}")
         raise APIException("[Text to Speech] Failed to convert text to speech.")
@@ -0,0 +1,82 @@
+import asyncio
+import importlib.util
+
+import httpx
+from django.conf import settings
+from openai import AsyncOpenAI, OpenAI
+
+from ayushma.utils.cache import LRUCache, hash_key
+
+
+def close_client(client):
+    """Closes the connections of a client dropped from `clients`."""
+    try:
+        if isinstance(client, tuple):
+            # async clients are closed in the loop their connections belong to
+            client, loop = client
+            if loop is None:
+                from ayushma.utils import openaiapi
+
+                loop = openaiapi.background_loop
+            if loop is not None and loop.is_running():
+                asyncio.run_coroutine_threadsafe(client.close(), loop)
+        else:
+            client.close()
+    except Exception as e:
+        print(f"Error closing OpenAI client: {e}")
+
+
+# clients by api key (and event loop for async clients), keys come per project
+# or per request so the least recently used ones are dropped and closed
+clients = LRUCache(maxsize=settings.OPENAI_CLIENT_CACHE_SIZE, on_evict=close_client)
+
+# http2 needs the optional h2 package
+http2 = settings.OPENAI_HTTP2 and importlib.util.find_spec("h2") is not None
+
+
+def get_client_options():
+    return {
+        "timeout": httpx.Timeout(settings.OPENAI_TIMEOUT, connect=10),
+        "limits": httpx.Limits(
+            max_connections=100,
+            max_keepalive_connections=20,
+            keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY,
+        ),
+        "http2": http2,
+    }
+
+
+def get_openai_client(api_key: str = settings.OPENAI_API_KEY) -> OpenAI:
+    """Returns a shared OpenAI client that keeps its connections alive."""
+    key = hash_key("sync", api_key)
+    client = clients.get(key)
+    if client is None:
+        client = OpenAI(
+            api_key=api_key,
+            max_retries=settings.OPENAI_MAX_RETRIES,
+            http_client=httpx.Client(**get_client_options()),
+        )
+        clients.set(key, client)
+    return client
+
+
+def get_async_openai_client(api_key: str = settings.OPENAI_API_KEY) -> AsyncOpenAI:
+    """
+    Same as `get_openai_client` for AsyncOpenAI. Connections belong to an event
+    loop, so there is one client per loop; outside of a running loop the client
+    is meant for the background loop of the sync streaming views.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    key = hash_key("async", api_key, loop and id(loop))
+    client, _ = clients.get(key, (None, None))
+    if client is None:
+        client = AsyncOpenAI(
+            api_key=api_key,
+            max_retries=settings.OPENAI_MAX_RETRIES,
+            http_client=httpx.AsyncClient(**get_client_options()),
+        )
+        clients.set(key, (client, loop))
+    return client
@@ -1,25 +1,74 @@
-import io
+import asyncio
 import json
+import os
+import threading
 import time
-from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Queue
 from typing import Dict, List
 
 import numpy as np
 import tiktoken
-from anyio.from_thread import start_blocking_portal
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from langchain.schema import AIMessage, HumanMessage
-from openai import OpenAI
+from django.db import connection
 
 from ayushma.models import ChatMessage
 from ayushma.models.chat import Chat
 from ayushma.models.document import Document
 from ayushma.models.enums import ChatMessageType, ModelType
-from ayushma.utils.langchain import LangChainHelper
-from ayushma.utils.language_helpers import text_to_speech, translate_text
+from ayushma.tasks.message_audio import save_streamed_audio
+from ayushma.utils.answer_cache import (
+    create_answer_from_cache,
+    find_cached_answer,
+    get_answer_cache_key,
+    store_cached_answer,
+)
+from ayushma.utils.audio_stream import AudioStream
+from ayushma.utils.cache import (
+    TieredCache,
+    hash_key,
+    is_cache_shared,
+    normalize_text,
+)
+from ayushma.utils.chat_history import (
+    aget_chat_history,
+    get_chat_history,
+    schedule_chat_summary,
+)
+from ayushma.utils.chunker import get_encoding
+from ayushma.utils.incremental_speech import (
+    REFERENCES_MARKER,
+    IncrementalSpeech,
+    tts_executor,
+)
+from ayushma.utils.langchain import NO_ANSWER_REPLY, LangChainHelper
+from ayushma.utils.language_helpers import (
+    sanitize_text,
+    text_to_speech,
+    translate_text,
+)
+from ayushma.utils.openai_client import get_async_openai_client, get_openai_client
+from ayushma.utils.speech_cache import (
+    find_stored_speech,
+    get_speech_name,
+    read_stored_speech,
+    save_speech,
+)
 from ayushma.utils.vectordb import VectorDB
 from core.settings.base import AI_NAME
 
+# limits of a single embedding request of text-embedding-ada-002
+EMBEDDING_MAX_TOKENS = 8191
+EMBEDDING_MAX_INPUTS = 2048
+
+# query embeddings stored as packed float32 bytes
+embedding_cache = TieredCache(
+    "embedding",
+    maxsize=settings.EMBEDDING_CACHE_SIZE,
+    timeout=settings.EMBEDDING_CACHE_TIMEOUT,
+)
+
 
 # https://github.com/openai/openai-python/blob/main/openai/embeddings_utils.py#L65
 def cosine_similarity(a, b):
@@ -53,7 +102,7 @@ def get_embedding(
         [[-0.123, 0.456, 0.789, ...], [0.123, -0.456, 0.789, ...]]
 
     """
-    client = OpenAI(api_key=openai_api_key)
+    client = get_openai_client(openai_api_key)
 
     embedding_args: Dict[str, str | List[str]] = {"input": text}
 
@@ -67,6 +116,87 @@ def get_embedding(
     return [record.embedding for record in res.data]
 
 
+async def aget_embedding(
+    text: List[str],
+    model: str = "text-embedding-ada-002",
+    openai_api_key: str = settings.OPENAI_API_KEY,
+) -> List[List[float]]:
+    """
+    Async version of `get_embedding` using the non-blocking OpenAI client.
+    """
+    client = get_async_openai_client(openai_api_key)
+
+    embedding_args: Dict[str, str | List[str]] = {"input": text}
+
+    if settings.OPENAI_API_TYPE == "azure":
+        embedding_args["engine"] = settings.AZURE_EMBEDDING_DEPLOYMENT
+    else:
+        embedding_args["model"] = model
+
+    res = await client.embeddings.create(**embedding_args)
+
+    return [record.embedding for record in res.data]
+
+
+def get_embedding_cache_keys(text: List[str], model: str) -> List[str]:
+    if settings.OPENAI_API_TYPE == "azure":
+        model = settings.AZURE_EMBEDDING_DEPLOYMENT
+    return [hash_key(model, normalize_text(item)) for item in text]
+
+
+def get_cached_embedding(
+    text: List[str],
+    model: str = "text-embedding-ada-002",
+    openai_api_key: str = settings.OPENAI_API_KEY,
+) -> List[List[float]]:
+    """
+    Same as `get_embedding`, but texts that were embedded before (ignoring case and
+    whitespace) are served from the embedding cache instead of the OpenAI API.
+    """
+    keys = get_embedding_cache_keys(text, model)
+    cached = embedding_cache.get_many(keys)
+
+    missing = {key: item for key, item in zip(keys, text) if key not in cached}
+    if missing:
+        embeddings = get_embedding(
+            list(missing.values()), model=model, openai_api_key=openai_api_key
+        )
+        fetched = {
+            key: np.asarray(embedding, dtype=np.float32).tobytes()
+            for key, embedding in zip(missing.keys(), embeddings)
+        }
+        embedding_cache.set_many(fetched)
+        cached.update(fetched)
+
+    return [np.frombuffer(cached[key], dtype=np.float32).tolist() for key in keys]
+
+
+async def aget_cached_embedding(
+    text: List[str],
+    model: str = "text-embedding-ada-002",
+    openai_api_key: str = settings.OPENAI_API_KEY,
+) -> List[List[float]]:
+    """
+    Async version of `get_cached_embedding`.
+    """
+    keys = get_embedding_cache_keys(text, model)
+    cached = await sync_to_async(embedding_cache.get_many, thread_sensitive=False)(keys)
+
+    missing = {key: item for key, item in zip(keys, text) if key not in cached}
+    if missing:
+        embeddings = await aget_embedding(
+            list(missing.values()), model=model, openai_api_key=openai_api_key
+        )
+        fetched = {
+            key: np.asarray(embedding, dtype=np.float32).tobytes()
+            for key, embedding in zip(missing.keys(), embeddings)
+        }
+        await sync_to_async(embedding_cache.set_many, thread_sensitive=False)(fetched)
+        cached.update(fetched)
+
+    return [np.frombuffer(cached[key], dtype=np.float32).tolist() for key in keys]
+
+
 def num_tokens_from_string(string: str, encoding_name: str) -> int:
     """Returns the number of tokens in a text string."""
     encoding = tiktoken.get_encoding(encoding_name)
@@ -74,17 +204,48 @@ def num_tokens_from_string(string: str, encoding_name: str) -> int:
     return num_tokens
 
 
-def split_text(text):
-    """Returns one string split into n equal length strings"""
-    n = len(text)
-    number_of_chars = 8192
-    parts = []
+def split_tokens(text, max_tokens=EMBEDDING_MAX_TOKENS):
+    """
+    Returns one string split into parts of at most `max_tokens` tokens, as
+    (part, number of tokens) pairs. The text is only encoded once.
+    """
+    encoding = get_encoding()
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return [(text, len(tokens))]
+    return [
+        (encoding.decode(tokens[i : i + max_tokens]), len(tokens[i : i + max_tokens]))
+        for i in range(0, len(tokens), max_tokens)
+    ]
 
-    for i in range(0, n, number_of_chars):
-        part = text[i : i + number_of_chars]
-        parts.append(part)
 
-    return parts
+def split_text(text, max_tokens=EMBEDDING_MAX_TOKENS):
+    """Returns one string split into parts of at most `max_tokens` tokens"""
+    return [part for part, _ in split_tokens(text, max_tokens)]
+
+
+def batch_by_tokens(items, count, max_tokens=None):
+    """
+    Packs items into batches for embedding requests, each within the per-request
+    token budget (EMBEDDING_BATCH_TOKENS) and input count limit. `count` returns
+    the number of tokens of an item, which must fit in the input token limit.
+    Yields each batch once it is full, so `items` can be a stream.
+    """
+    max_tokens = max_tokens or settings.EMBEDDING_BATCH_TOKENS
+    batch = []
+    batch_tokens = 0
+    for item in items:
+        tokens = count(item)
+        if batch and (
+            batch_tokens + tokens > max_tokens or len(batch) >= EMBEDDING_MAX_INPUTS
+        ):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append(item)
+        batch_tokens += tokens
+    if batch:
+        yield batch
 
 
 def create_json_response(
@@ -104,19 +265,22 @@ def create_json_response(
 
 
 def get_reference(text, openai_key, namespace, top_k):
-    num_tokens = num_tokens_from_string(text, "cl100k_base")
+    parts = split_text(text)
     embeddings: List[List[List[float]]] = []
-    if num_tokens < 8192:
+    if len(parts) == 1:
         try:
-            embeddings.append(get_embedding(text=[text], openai_api_key=openai_key))
+            embeddings.append(
+                get_cached_embedding(text=[text], openai_api_key=openai_key)
+            )
         except Exception as e:
             print(f"Error generating embeddings: {e}")
             return Exception("[Reference] Error generating embeddings")
     else:
-        parts = split_text(text)
         for part in parts:
             try:
-                embeddings.append(get_embedding(text=[part], openai_api_key=openai_key))
+                embeddings.append(
+                    get_cached_embedding(text=[part], openai_api_key=openai_key)
+                )
             except Exception as e:
                 print(f"Error generating embeddings: {e}")
                 raise Exception(
@@ -136,6 +300,212 @@ def get_reference(text, openai_key, namespace, top_k):
     return vdb.sanitize(similar)
 
 
+async def aget_reference(text, openai_key, namespace, top_k):
+    parts = split_text(text)
+    try:
+        embeddings: List[List[List[float]]] = await asyncio.gather(
+            *[
+                aget_cached_embedding(text=[part], openai_api_key=openai_key)
+                for part in parts
+            ]
+        )
+    except Exception as e:
+        print(f"Error generating embeddings: {e}")
+        raise Exception("[Reference] Error generating embeddings")
+
+    # vector db clients are blocking, run them off the event loop
+    flat_embeddings = [item for sublist in embeddings for item in sublist]
+    vdb = await sync_to_async(VectorDB, thread_sensitive=False)()
+    similar = await sync_to_async(vdb.search, thread_sensitive=False)(
+        embeddings=flat_embeddings,
+        partition_name=namespace,
+        limit=int(top_k),
+    )
+
+    print("References fetched")
+    return vdb.sanitize(similar)
+
+
+def get_message_meta(stats):
+    return {
+        "translate_start": stats.get("response_translation_start_time"),
+        "translate_end": stats.get("response_translation_end_time"),
+        "reference_start": stats.get("reference_start_time"),
+        "reference_end": stats.get("reference_end_time"),
+        "response_start": stats.get("response_start_time"),
+        "response_end": stats.get("response_end_time"),
+        "tts_start": stats.get("tts_start_time"),
+        "tts_end": stats.get("tts_end_time"),
+        "upload_start": stats.get("upload_start_time"),
+        "upload_end": stats.get("upload_end_time"),
+        "history_start": stats.get("history_start_time"),
+        "history_end": stats.get("history_end_time"),
+        "answer_cache": stats.get("answer_cache"),
+    }
+
+
+def get_answer_from_cache(
+    chat,
+    first_question,
+    english_text,
+    openai_key,
+    language,
+    references=None,
+    fetch_references=True,
+    documents=None,
+    use_answer_cache=True,
+):
+    """
+    Looks up a cached answer for the first question of a chat in projects with the
+    answer cache enabled.
+
+    Returns the cache key and query embedding to store the new answer with (both
+    None when the cache does not apply) and the cached answer, if any.
+    """
+    project = chat.project
+    if not (use_answer_cache and project and project.answer_cache and fetch_references):
+        return None, None, None
+    if references or documents:
+        return None, None, None
+    # answers depend on the chat history, only first questions are cached
+    if not first_question:
+        return None, None, None
+
+    prompt = chat.prompt or project.prompt
+    model = chat.model or project.model or ModelType.GPT_3_5
+    try:
+        query_embedding = get_cached_embedding(
+            text=[english_text], openai_api_key=openai_key
+        )[0]
+        key = get_answer_cache_key(prompt, model, language)
+        return key, query_embedding, find_cached_answer(project, key, query_embedding)
+    except Exception as e:
+        print(f"Error reading answer cache: {e}")
+        return None, None, None
+
+
+def get_references(
+    chat, english_text, openai_key, match_number, references, fetch_references
+):
+    if references:
+        return references
+    if not (fetch_references and chat.project and chat.project.external_id):
+        return ""
+    try:
+        return get_reference(
+            english_text,
+            openai_key,
+            str(chat.project.external_id).replace("-", "_"),
+            match_number,
+        )
+    except Exception as e:
+        print(f"Error fetching references: {e}")
+        return ""
+
+
+async def aget_references(
+    chat, english_text, openai_key, match_number, references, fetch_references
+):
+    if references:
+        return references
+    if not (fetch_references and chat.project and chat.project.external_id):
+        return ""
+    try:
+        return await aget_reference(
+            english_text,
+            openai_key,
+            str(chat.project.external_id).replace("-", "_"),
+            match_number,
+        )
+    except Exception as e:
+        print(f"Error fetching references: {e}")
+        return ""
+
+
+def retrieve_context(
+    chat,
+    first_question,
+    english_text,
+    openai_key,
+    language,
+    match_number,
+    stats,
+    references=None,
+    fetch_references=True,
+    documents=None,
+    use_answer_cache=True,
+):
+    """
+    Looks up the answer cache and fetches the references for a question. Runs in
+    `context_executor` while converse stores the question and loads the history.
+
+    Returns the answer cache key, query embedding and cached answer (see
+    `get_answer_from_cache`) and the references.
+    """
+    try:
+        answer_cache_key, query_embedding, cached_answer = get_answer_from_cache(
+            chat,
+            first_question,
+            english_text,
+            openai_key,
+            language,
+            references,
+            fetch_references,
+            documents,
+            use_answer_cache,
+        )
+        if cached_answer:
+            return answer_cache_key, query_embedding, cached_answer, ""
+
+        stats["reference_start_time"] = time.time()
+        reference = get_references(
+            chat, english_text, openai_key, match_number, references, fetch_references
+        )
+        stats["reference_end_time"] = time.time()
+        return answer_cache_key, query_embedding, None, reference
+    finally:
+        # the worker thread has its own database connection
+        connection.close()
+
+
+async def aretrieve_context(
+    chat,
+    first_question,
+    english_text,
+    openai_key,
+    language,
+    match_number,
+    stats,
+    references=None,
+    fetch_references=True,
+    documents=None,
+    use_answer_cache=True,
+):
+    """Async version of `retrieve_context`."""
+    answer_cache_key, query_embedding, cached_answer = await sync_to_async(
+        get_answer_from_cache
+    )(
+        chat,
+        first_question,
+        english_text,
+        openai_key,
+        language,
+        references,
+        fetch_references,
+        documents,
+        use_answer_cache,
+    )
+    if cached_answer:
+        return answer_cache_key, query_embedding, cached_answer, ""
+
+    stats["reference_start_time"] = time.time()
+    reference = await aget_references(
+        chat, english_text, openai_key, match_number, references, fetch_references
+    )
+    stats["reference_end_time"] = time.time()
+    return answer_cache_key, query_embedding, None, reference
+
+
 def add_reference_documents(chat_message):
     ref_text = "References:"
     chat_text = str(chat_message.original_message)
@@ -172,8 +542,14 @@ def handle_post_response(
     language,
     tts_engine,
     generate_audio=True,
+    answer_cache_key=None,
+    query_embedding=None,
+    speech=None,
+    audio_stream=None,
 ):
     chat_message: ChatMessage = ChatMessage.objects.create(
+        # the audio stream was announced with the id of the message
+        **({"external_id": audio_stream.message_id} if audio_stream else {}),
         original_message=chat_response,
         chat=chat,
         messageType=ChatMessageType.AYUSHMA,
@@ -183,46 +559,338 @@ def handle_post_response(
     )
     add_reference_documents(chat_message)
     translated_chat_response = chat_message.original_message
-    if user_language != "en-IN":
-        stats["response_translation_start_time"] = time.time()
-        translated_chat_response = translate_text(
-            user_language, chat_message.original_message
-        )
-    stats["response_translation_end_time"] = time.time()
-
+    # the text of the audio
+    speech_text = translated_chat_response
     ayushma_voice = None
+    if speech:
+        # voiced sentence by sentence while streaming; those translations lack
+        # the context of the whole answer, so the message is translated again
+        translation = None
+        if user_language != "en-IN":
+            translation = tts_executor.submit(
+                translate_text, user_language, chat_message.original_message
+            )
+        speech_text, ayushma_voice = speech.finish(stats)
+        if translation:
+            translated_chat_response = translation.result()
+            stats["response_translation_end_time"] = time.time()
+    else:
+        if user_language != "en-IN":
+            stats["response_translation_start_time"] = time.time()
+            translated_chat_response = translate_text(
+                user_language, chat_message.original_message
+            )
+            speech_text = translated_chat_response
+        stats["response_translation_end_time"] = time.time()
+
+    speech_name = None
     if generate_audio:
+        speech_name = get_speech_name(speech_text, user_language, tts_engine)
+
+    if generate_audio and not speech:
         stats["tts_start_time"] = time.time()
-        ayushma_voice = text_to_speech(
-            translated_chat_response, user_language, tts_engine
-        )
+        # the same text was voiced before, e.g. a canned reply
+        if find_stored_speech(speech_name):
+            chat_message.audio = speech_name
+            if audio_stream:
+                audio_stream.write(read_stored_speech(speech_name))
+        else:
+            ayushma_voice = text_to_speech(
+                translated_chat_response, user_language, tts_engine
+            )
+            if audio_stream:
+                audio_stream.write(ayushma_voice)
         stats["tts_end_time"] = time.time()
+        if audio_stream:
+            audio_stream.close()
 
+    # a streamed audio is uploaded by a task reading it from the cache, which
+    # only works if the task sees the same cache
+    upload_later = audio_stream and is_cache_shared()
     url = None
-    if ayushma_voice:
+    if ayushma_voice and not upload_later:
         stats["upload_start_time"] = time.time()
-        chat_message.audio.save(
-            f"{chat_message.external_id}.mp3", io.BytesIO(ayushma_voice)
-        )
+        chat_message.audio = save_speech(speech_name, ayushma_voice)
         stats["upload_end_time"] = time.time()
+    if audio_stream:
+        url = audio_stream.url
+    elif chat_message.audio:
+        url = chat_message.audio.url
 
     chat_message.message = translated_chat_response
-    chat_message.meta = {
-        "translate_start": stats.get("response_translation_start_time"),
-        "translate_end": stats.get("response_translation_end_time"),
-        "reference_start": stats.get("reference_start_time"),
-        "reference_end": stats.get("reference_end_time"),
-        "response_start": stats.get("response_start_time"),
-        "response_end": stats.get("response_end_time"),
-        "tts_start": stats.get("tts_start_time"),
-        "tts_end": stats.get("tts_end_time"),
-        "upload_start": stats.get("upload_start_time"),
-        "upload_end": stats.get("upload_end_time"),
-    }
+    chat_message.meta = get_message_meta(stats)
     chat_message.save()
+
+    # the audio is served from the stream until it is uploaded
+    if ayushma_voice and upload_later:
+        save_streamed_audio.delay(
+            chat_message.id, str(audio_stream.message_id), speech_name
+        )
+
+    if answer_cache_key:
+        store_cached_answer(
+            chat.project, answer_cache_key, query_embedding, chat_message
+        )
+
     return translated_chat_response, url, chat_message
 
 
+# event loop shared by the streaming responses of the sync views, so the clients
+# of cached chains keep their connections between requests
+background_loop = None
+background_loop_pid = None
+background_loop_lock = threading.Lock()
+
+
+def get_background_loop():
+    global background_loop, background_loop_pid
+    with background_loop_lock:
+        # a loop inherited from the parent process has no thread running it
+        if background_loop is None or background_loop_pid != os.getpid():
+            background_loop = asyncio.new_event_loop()
+            background_loop_pid = os.getpid()
+            threading.Thread(target=background_loop.run_forever, daemon=True).start()
+        return background_loop
+
+
+# runs `retrieve_context` for the sync views
+context_executor = ThreadPoolExecutor(
+    max_workers=settings.CONTEXT_RETRIEVAL_WORKERS,
+    thread_name_prefix="context",
+)
+
+
+def get_chat_model(chat):
+    return chat.model or (chat.project and chat.project.model) or ModelType.GPT_3_5
+
+
+def get_prompt(chat, documents=None):
+    prompt = chat.prompt or (chat.project and chat.project.prompt)
+
+    if documents or (chat.project and chat.project.model == ModelType.GPT_4_VISUAL):
+        prompt = "Image Capabilities: Enabled\n" + prompt
+    return prompt
+
+
+def create_query_message(
+    chat, english_text, local_translated_text, language, stats, noonce
+):
+    return ChatMessage.objects.create(
+        message=local_translated_text,
+        original_message=english_text,
+        chat=chat,
+        messageType=ChatMessageType.USER,
+        language=language,
+        meta={
+            "translate_start": stats.get("request_translation_start_time"),
+            "translate_end": stats.get("request_translation_end_time"),
+        },
+        noonce=noonce,
+    )
+
+
+def answer_from_cache(
+    cached_answer,
+    chat,
+    match_number,
+    user_language,
+    temperature,
+    language,
+    stats,
+    generate_audio,
+):
+    stats["answer_cache"] = "hit"
+    return create_answer_from_cache(
+        cached_answer,
+        chat,
+        match_number,
+        user_language,
+        temperature,
+        language,
+        chat.project.tts_engine,
+        get_message_meta(stats),
+        generate_audio,
+    )
+
+
+# answers the model gives word for word, their speech is usually stored already
+known_answers = [normalize_text(NO_ANSWER_REPLY)]
+
+
+def may_be_known_answer(text):
+    """Whether a streamed answer is, or may still turn into, one of known_answers."""
+    answer, marker, _ = text.partition(REFERENCES_MARKER)
+    if not marker:
+        # the marker may be arriving token by token
+        for length in range(len(REFERENCES_MARKER) - 1, 0, -1):
+            if answer.endswith(REFERENCES_MARKER[:length]):
+                answer = answer[:-length]
+                break
+    answer = normalize_text(sanitize_text(answer)).rstrip(".")
+    if marker:
+        return answer in known_answers
+    return any(known_answer.startswith(answer) for known_answer in known_answers)
+
+
+def get_message_audio_url(chat_message):
+    return chat_message.audio.url if chat_message.audio else None
+
+
+def strip_ai_name(text):
+    text = text.lstrip()
+    if text.startswith(f"{AI_NAME}:"):
+        text = text[len(f"{AI_NAME}:") :].lstrip()
+    return text
+
+
+class ResponseStream:
+    """
+    A streamed answer, shared by `converse` and `aconverse` which only differ in
+    how they receive the tokens of the model. Turns the tokens into response
+    frames, voices the answer as it arrives and stores it once it is complete.
+    """
+
+    def __init__(
+        self,
+        chat,
+        local_translated_text,
+        match_number,
+        user_language,
+        temperature,
+        language,
+        stats,
+        generate_audio,
+        answer_cache_key=None,
+        query_embedding=None,
+    ):
+        self.chat = chat
+        self.local_translated_text = local_translated_text
+        self.match_number = match_number
+        self.user_language = user_language
+        self.temperature = temperature
+        self.language = language
+        self.stats = stats
+        self.generate_audio = generate_audio
+        self.answer_cache_key = answer_cache_key
+        self.query_embedding = query_embedding
+        self.tts_engine = chat.project and chat.project.tts_engine
+        self.chat_response = ""
+        self.started = False
+
+        self.audio_stream = None
+        self.audio_url = None
+        if generate_audio:
+            self.audio_stream = AudioStream(chat)
+            self.audio_url = self.audio_stream.url
+        # created once the answer cannot be a known one, whose speech is looked
+        # up in the storage when it is complete instead of being synthesised
+        self.speech = None
+
+    def create_response(self, delta, message, stop=False, error=False, voice=None):
+        return create_json_response(
+            self.local_translated_text,
+            self.chat.external_id,
+            delta,
+            message,
+            stop,
+            error,
+            voice,
+        )
+
+    def voice(self, text):
+        """Feeds text of the answer to the incremental speech."""
+        if not self.generate_audio or not settings.INCREMENTAL_TTS:
+            return
+        if not self.speech:
+            if may_be_known_answer(self.chat_response):
+                return
+            self.speech = IncrementalSpeech(
+                self.user_language, self.tts_engine, self.audio_stream
+            )
+            # including the text held back while it looked like a known answer
+            text = self.chat_response
+        self.speech.feed(text)
+
+    def add_token(self, token):
+        """
+        Returns the frame of a token of the model, or None while the start of the
+        answer is held back.
+        """
+        self.chat_response += token
+        if not self.started:
+            # the model may open with its name, which is dropped once, before the
+            # first frame, instead of being replaced in the whole answer per token
+            prefix = f"{AI_NAME}:"
+            text = self.chat_response.lstrip()
+            if prefix.startswith(text):
+                return None
+            text = strip_ai_name(text)
+            if not text:
+                return None
+            self.started = True
+            self.chat_response = token = text
+
+        self.voice(token)
+        message = ""
+        if not settings.STREAM_DELTA_ONLY:
+            message = self.chat_response
+        return self.create_response(token, message, voice=self.audio_url)
+
+    def finish(self):
+        """Stores the complete answer and returns the last frame."""
+        self.stats["response_end_time"] = time.time()
+        chat_response = self.chat_response
+        if not self.started:
+            # a short answer that never got past the held back start
+            self.chat_response = chat_response = strip_ai_name(chat_response)
+            self.voice(chat_response)
+        translated_chat_response, url, chat_message = handle_post_response(
+            chat_response,
+            self.chat,
+            self.match_number,
+            self.user_language,
+            self.temperature,
+            self.stats,
+            self.language,
+            self.tts_engine,
+            self.generate_audio,
+            answer_cache_key=self.answer_cache_key,
+            query_embedding=self.query_embedding,
+            speech=self.speech,
+            audio_stream=self.audio_stream,
+        )
+        return self.create_response("", translated_chat_response, True, voice=url)
+
+    def fail(self, error):
+        """Records the failure of the stream and returns the error frame."""
+        print(f"Error in streaming response: {error}")
+        error_text = (
+            "[Streaming] Something went wrong in getting response, stream stopped"
+        )
+        translated_error_text = error_text
+        if self.user_language != "en-IN":
+            translated_error_text = translate_text(
+                self.user_language, error_text, shared=True
+            )
+
+        ChatMessage.objects.create(
+            message=translated_error_text,
+            original_message=error_text,
+            chat=self.chat,
+            messageType=ChatMessageType.SYSTEM,
+            language=self.language,
+            meta=get_message_meta(self.stats),
+        )
+        return self.create_response("", str(error), True, True)
+
+    def close(self):
+        # client disconnected or response failed: stop voicing the answer
+        if self.speech:
+            self.speech.cancel()
+        if self.audio_stream:
+            self.audio_stream.close()
+
+
 def converse(
     english_text,
     local_translated_text,
@@ -238,75 +906,82 @@ def converse(
     noonce=None,
     fetch_references=True,
     documents=None,
+    use_answer_cache=True,
 ):
     if not openai_key:
         raise Exception("OpenAI-Key header is required to create a chat or converse")
 
     english_text = english_text.replace("\n", " ")
     language = user_language.split("-")[0]
-    nurse_query = ChatMessage.objects.create(
-        message=local_translated_text,
-        original_message=english_text,
-        chat=chat,
-        messageType=ChatMessageType.USER,
-        language=language,
-        meta={
-            "translate_start": stats.get("request_translation_start_time"),
-            "translate_end": stats.get("request_translation_end_time"),
-        },
-        noonce=noonce,
+
+    # embed and search for references while the question is stored and the
+    # history is loaded
+    first_question = not ChatMessage.objects.filter(chat=chat).exists()
+    context = context_executor.submit(
+        retrieve_context,
+        chat,
+        first_question,
+        english_text,
+        openai_key,
+        language,
+        match_number,
+        stats,
+        references,
+        fetch_references,
+        documents,
+        use_answer_cache,
     )
 
-    stats["reference_start_time"] = time.time()
+    nurse_query = create_query_message(
+        chat, english_text, local_translated_text, language, stats, noonce
+    )
 
-    if references:
-        reference = references
-    elif fetch_references and chat.project and chat.project.external_id:
-        try:
-            reference = get_reference(
-                english_text,
-                openai_key,
-                str(chat.project.external_id).replace("-", "_"),
-                match_number,
+    model = get_chat_model(chat)
+
+    # excluding the latest query since it is not a history
+    stats["history_start_time"] = time.time()
+    chat_history, history_boundary_id = get_chat_history(chat, nurse_query.id, model)
+    stats["history_end_time"] = time.time()
+
+    answer_cache_key, query_embedding, cached_answer, reference = context.result()
+    if cached_answer:
+        chat_message = answer_from_cache(
+            cached_answer,
+            chat,
+            match_number,
+            user_language,
+            temperature,
+            language,
+            stats,
+            generate_audio,
+        )
+        if stream:
+            yield create_json_response(
+                local_translated_text,
+                chat.external_id,
+                "",
+                chat_message.message,
+                True,
+                False,
+                get_message_audio_url(chat_message),
             )
-        except Exception as e:
-            print(f"Error fetching references: {e}")
-            reference = ""
-    else:
-        reference = ""
+        else:
+            yield chat_message
+        return
+    if answer_cache_key:
+        stats["answer_cache"] = "miss"
 
-    stats["reference_end_time"] = time.time()
+    # summarise the messages left out of the history for the next questions
+    schedule_chat_summary(chat, history_boundary_id, openai_key, model)
 
     stats["response_start_time"] = time.time()
 
-    prompt = chat.prompt or (chat.project and chat.project.prompt)
-
-    if documents or (chat.project and chat.project.model == ModelType.GPT_4_VISUAL):
-        prompt = "Image Capabilities: Enabled\n" + prompt
-
-    # excluding the latest query since it is not a history
-    previous_messages = (
-        ChatMessage.objects.filter(chat=chat)
-        .exclude(id=nurse_query.id)
-        .order_by("created_at")
-    )
-    chat_history = []
-    for message in previous_messages:
-        if message.messageType == ChatMessageType.USER:
-            chat_history.append(HumanMessage(content=f"{message.message}"))
-        elif message.messageType == ChatMessageType.AYUSHMA:
-            chat_history.append(AIMessage(content=f"Ayushma: {message.message}"))
-
-    tts_engine = chat.project and chat.project.tts_engine
-
     if not stream:
         lang_chain_helper = LangChainHelper(
             stream=False,
             openai_api_key=openai_key,
-            prompt_template=prompt,
-            model=chat.model
-            or (chat.project and chat.project.model)
-            or ModelType.GPT_3_5,
+            prompt_template=get_prompt(chat, documents),
+            model=model,
             temperature=temperature,
         )
         response = lang_chain_helper.get_response(
@@ -322,125 +997,229 @@ def converse(
             temperature,
             stats,
             language,
-            tts_engine,
+            chat.project and chat.project.tts_engine,
             generate_audio,
+            answer_cache_key=answer_cache_key,
+            query_embedding=query_embedding,
         )
 
         yield chat_message
+        return
 
-    else:
-        token_queue = Queue()
-        RESPONSE_END = object()
-        RESPONSE_ERROR = object()
+    response_stream = ResponseStream(
+        chat,
+        local_translated_text,
+        match_number,
+        user_language,
+        temperature,
+        language,
+        stats,
+        generate_audio,
+        answer_cache_key,
+        query_embedding,
+    )
+    token_queue = Queue()
+    RESPONSE_END = object()
+    RESPONSE_ERROR = object()
+    response_task = None
+    try:
+        lang_chain_helper = LangChainHelper(
+            stream=True,
+            openai_api_key=openai_key,
+            prompt_template=get_prompt(chat, documents),
+            model=model,
+            temperature=temperature,
+        )
+        response_task = asyncio.run_coroutine_threadsafe(
+            lang_chain_helper.get_aresponse(
+                RESPONSE_END,
+                RESPONSE_ERROR,
+                token_queue,
+                english_text,
+                reference,
+                chat_history,
+                documents,
+            ),
+            get_background_loop(),
+        )
+        while True:
+            try:
+                # block until the LLM produces a token instead of polling the queue
+                next_token = token_queue.get(
+                    True, timeout=settings.STREAM_TOKEN_TIMEOUT
+                )
+            except Empty:
+                raise Exception(
+                    "[Streaming] Timed out waiting for response from the model"
+                )
+            if next_token[0] == RESPONSE_ERROR:
+                raise next_token[1]
+            if next_token[0] is RESPONSE_END:
+                yield response_stream.finish()
+                break
+            response = response_stream.add_token(next_token[0])
+            if response:
+                yield response
+    except Exception as e:
+        yield response_stream.fail(e)
+    finally:
+        # client disconnected or response failed: stop the LLM task
+        if response_task and not response_task.done():
+            response_task.cancel()
+        response_stream.close()
 
-        try:
-            lang_chain_helper = LangChainHelper(
-                stream=stream,
-                token_queue=token_queue,
-                end=RESPONSE_END,
-                error=RESPONSE_ERROR,
-                openai_api_key=openai_key,
-                prompt_template=prompt,
-                model=chat.model
-                or (chat.project and chat.project.model)
-                or ModelType.GPT_3_5,
-                temperature=temperature,
+
+async def aconverse(
+    english_text,
+    local_translated_text,
+    openai_key,
+    chat,
+    match_number,
+    user_language,
+    temperature,
+    stats={},
+    references=None,
+    generate_audio=True,
+    noonce=None,
+    fetch_references=True,
+    documents=None,
+    use_answer_cache=True,
+):
+    """
+    Async counterpart of the streaming branch of `converse`.
+
+    Used when the app is served over ASGI: the LLM stream is consumed on the event
+    loop so an open stream does not hold a worker thread. Blocking work
+    (translation, TTS, upload) is still delegated to threads.
+    """
+    if not openai_key:
+        raise Exception("OpenAI-Key header is required to create a chat or converse")
+
+    english_text = english_text.replace("\n", " ")
+    language = user_language.split("-")[0]
+
+    # embed and search for references while the question is stored and the
+    # history is loaded
+    first_question = not await ChatMessage.objects.filter(chat=chat).aexists()
+    context = asyncio.create_task(
+        aretrieve_context(
+            chat,
+            first_question,
+            english_text,
+            openai_key,
+            language,
+            match_number,
+            stats,
+            references,
+            fetch_references,
+            documents,
+            use_answer_cache,
+        )
+    )
+
+    nurse_query = await sync_to_async(create_query_message)(
+        chat, english_text, local_translated_text, language, stats, noonce
+    )
+
+    model = get_chat_model(chat)
+
+    # excluding the latest query since it is not a history
+    stats["history_start_time"] = time.time()
+    chat_history, history_boundary_id = await aget_chat_history(
+        chat, nurse_query.id, model
+    )
+    stats["history_end_time"] = time.time()
+
+    answer_cache_key, query_embedding, cached_answer, reference = await context
+    if cached_answer:
+        chat_message = await sync_to_async(answer_from_cache)(
+            cached_answer,
+            chat,
+            match_number,
+            user_language,
+            temperature,
+            language,
+            stats,
+            generate_audio,
+        )
+        yield create_json_response(
+            local_translated_text,
+            chat.external_id,
+            "",
+            chat_message.message,
+            True,
+            False,
+            await sync_to_async(get_message_audio_url)(chat_message),
+        )
+        return
+    if answer_cache_key:
+        stats["answer_cache"] = "miss"
+
+    # summarise the messages left out of the history for the next questions
+    schedule_chat_summary(chat, history_boundary_id, openai_key, model)
+
+    stats["response_start_time"] = time.time()
+
+    response_stream = await sync_to_async(ResponseStream)(
+        chat,
+        local_translated_text,
+        match_number,
+        user_language,
+        temperature,
+        language,
+        stats,
+        generate_audio,
+        answer_cache_key,
+        query_embedding,
+    )
+    token_queue = asyncio.Queue()
+    RESPONSE_END = object()
+    RESPONSE_ERROR = object()
+    response_task = None
+    try:
+        lang_chain_helper = LangChainHelper(
+            stream=True,
+            openai_api_key=openai_key,
+            prompt_template=get_prompt(chat, documents),
+            model=model,
+            temperature=temperature,
+        )
+        response_task = asyncio.create_task(
+            lang_chain_helper.get_aresponse(
+                RESPONSE_END,
+                RESPONSE_ERROR,
+                token_queue,
+                english_text,
+                reference,
+                chat_history,
+                documents,
             )
-            with start_blocking_portal() as portal:
-                portal.start_task_soon(
-                    lang_chain_helper.get_aresponse,
-                    RESPONSE_END,
-                    RESPONSE_ERROR,
-                    token_queue,
-                    english_text,
-                    reference,
-                    chat_history,
-                    documents,
+        )
+        while True:
+            try:
+                next_token = await asyncio.wait_for(
+                    token_queue.get(), timeout=settings.STREAM_TOKEN_TIMEOUT
                 )
-                chat_response = ""
-                while True:
-                    if token_queue.empty():
-                        continue
-                    next_token = token_queue.get(True, timeout=10)
-                    if next_token[0] == RESPONSE_ERROR:
-                        raise next_token[1]
-                    if next_token[0] is RESPONSE_END:
-                        stats["response_end_time"] = time.time()
-                        (
-                            translated_chat_response,
-                            url,
-                            chat_message,
-                        ) = handle_post_response(
-                            chat_response,
-                            chat,
-                            match_number,
-                            user_language,
-                            temperature,
-                            stats,
-                            language,
-                            tts_engine,
-                            generate_audio,
-                        )
-
-                        yield create_json_response(
-                            local_translated_text,
-                            chat.external_id,
-                            "",
-                            translated_chat_response,
-                            True,
-                            False,
-                            ayushma_voice=url,
-                        )
-                        break
-
-                    chat_response += next_token[0]
-                    chat_response = chat_response.replace(f"{AI_NAME}:", "").lstrip()
-                    yield create_json_response(
-                        local_translated_text,
-                        chat.external_id,
-                        next_token[0],
-                        chat_response,
-                        False,
-                        False,
-                        None,
-                    )
-        except Exception as e:
-            print(f"Error in streaming response: {e}")
-            error_text = (
-                "[Streaming] Something went wrong in getting response, stream stopped"
-            )
-            translated_error_text = error_text
-            if user_language != "en-IN":
-                translated_error_text = translate_text(user_language, error_text)
-
-            ChatMessage.objects.create(
-                message=translated_error_text,
-                original_message=error_text,
-                chat=chat,
-                messageType=ChatMessageType.SYSTEM,
-                language=language,
-                meta={
-                    "translate_start": stats.get("response_translation_start_time"),
-                    "translate_end": stats.get("response_translation_end_time"),
-                    "reference_start": stats.get("reference_start_time"),
-                    "reference_end": stats.get("reference_end_time"),
-                    "response_start": stats.get("response_start_time"),
-                    "response_end": stats.get("response_end_time"),
-                    "tts_start": stats.get("tts_start_time"),
-                    "tts_end": stats.get("tts_end_time"),
-                    "upload_start": stats.get("upload_start_time"),
-                    "upload_end": stats.get("upload_end_time"),
-                },
-            )
-            yield create_json_response(
-                local_translated_text,
-                chat.external_id,
-                "",
-                str(e),
-                True,
-                True,
-                None,
-            )
+            except asyncio.TimeoutError:
+                raise Exception(
+                    "[Streaming] Timed out waiting for response from the model"
+                )
+            if next_token[0] == RESPONSE_ERROR:
+                raise next_token[1]
+            if next_token[0] is RESPONSE_END:
+                yield await sync_to_async(response_stream.finish)()
+                break
+            response = response_stream.add_token(next_token[0])
+            if response:
+                yield response
+    except Exception as e:
+        yield await sync_to_async(response_stream.fail)(e)
+    finally:
+        # client disconnected (see utils.asgi) or response failed: stop the LLM
+        # task and the speech
+        if response_task and not response_task.done():
+            response_task.cancel()
+        await sync_to_async(response_stream.close)()
 
 
 def converse_thread(
@@ -448,7 +1227,7 @@ def converse_thread(
     thread: Chat,
     openai_key,
 ):
-    client = OpenAI(api_key=openai_key)
+    client = get_openai_client(openai_key)
 
     if not thread.thread_id:
         thread_id = client.beta.threads.create().id
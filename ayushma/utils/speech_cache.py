@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from ayushma.utils.cache import LRUCache, hash_key, normalize_text
+from ayushma.utils.language_helpers import get_tts_voice, sanitize_text, text_to_speech
+
+# names of the speech files known to be in the storage
+stored_speech = LRUCache(maxsize=4096)
+
+
+def get_speech_name(text, language_code, service):
+    """Storage name of the speech of `text`, the same for every message saying it."""
+    voice = get_tts_voice(language_code, service)
+    key = hash_key(service, voice, normalize_text(sanitize_text(text)))
+    return f"tts/{key}.mp3"
+
+
+def find_stored_speech(name):
+    if not settings.TTS_CACHE:
+        return False
+    if stored_speech.get(name):
+        return True
+    try:
+        exists = default_storage.exists(name)
+    except Exception as e:
+        print(f"Error looking up stored speech: {e}")
+        return False
+    if exists:
+        stored_speech.set(name, True)
+    return exists
+
+
+def read_stored_speech(name):
+    with default_storage.open(name, "rb") as file:
+        return file.read()
+
+
+def save_speech(name, audio):
+    name = default_storage.save(name, ContentFile(audio))
+    stored_speech.set(name, True)
+    return name
+
+
+def text_to_speech_file(text, language_code, service):
+    """
+    Returns the storage name of the speech of `text`. It is only synthesised and
+    uploaded if it is not stored yet.
+    """
+    name = get_speech_name(text, language_code, service)
+    if find_stored_speech(name):
+        return name
+    audio = text_to_speech(text, language_code, service)
+    if not audio:
+        return None
+    return save_speech(name, audio)
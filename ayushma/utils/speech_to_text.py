@@ -1,11 +1,23 @@
+import json
 import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.http import StreamingHttpResponse
 from google.cloud import speech
-from openai import OpenAI
 
 from ayushma.models.enums import STTEngine
+from ayushma.utils.audio_processing import (
+    PREPROCESSED_CONTENT_TYPE,
+    SAMPLE_RATE,
+    merge_transcripts,
+    split_audio,
+)
+from ayushma.utils.openai_client import get_openai_client
 
 
 class WhisperEngine:
@@ -15,7 +27,7 @@ class WhisperEngine:
 
     def recognize(self, audio):
         try:
-            client = OpenAI(api_key=self.api_key)
+            client = get_openai_client(self.api_key)
             transcription = client.audio.transcriptions.create(
                 model="whisper-1",
                 # https://github.com/openai/openai-python/tree/main#file-uploads
@@ -46,11 +58,18 @@ class GoogleEngine:
                 encoding=speech.RecognitionConfig.AudioEncoding.ENCODING_UNSPECIFIED,
                 language_code=self.language_code,
             )
+            # the encoding of ogg/opus is not detected from its header
+            if getattr(audio, "content_type", None) == PREPROCESSED_CONTENT_TYPE:
+                config.encoding = speech.RecognitionConfig.AudioEncoding.OGG_OPUS
+                config.sample_rate_hertz = SAMPLE_RATE
 
             response = client.recognize(config=config, audio=audio_data)
-            if not response.results:
-                return ""
-            return response.results[0].alternatives[0].transcript
+            # a result per utterance
+            return " ".join(
+                result.alternatives[0].transcript
+                for result in response.results
+                if result.alternatives
+            ).strip()
         except Exception as e:
             print(f"Failed to recognize speech with google engine: {e}")
             raise ValueError(
@@ -93,7 +112,12 @@ engines = {
 }
 
 
-def speech_to_text(engine_id, audio, language_code):
+stt_executor = ThreadPoolExecutor(
+    max_workers=settings.STT_WORKERS, thread_name_prefix="stt"
+)
+
+
+def get_engine(engine_id, language_code):
     api_key = os.environ.get("STT_API_KEY", "")
     engine_name = STTEngine(engine_id).name.lower()
     engine_class = engines.get(engine_name)
@@ -102,14 +126,128 @@ def speech_to_text(engine_id, audio, language_code):
         print(f"Invalid Speech to Text engine: {engine_name}")
         raise ValueError("The selected Speech to Text engine is not valid")
 
+    return engine_class(api_key, language_code), engine_name
+
+
+def transcribe_chunks(engine, chunks):
+    """
+    Transcribes the chunks concurrently, yields their transcripts in order. The
+    ones done are yielded while the next chunks are still being encoded.
+    """
+    transcripts = deque()
+    try:
+        for chunk in chunks:
+            transcripts.append(stt_executor.submit(engine.recognize, chunk))
+            while transcripts and transcripts[0].done():
+                yield transcripts.popleft().result()
+        while transcripts:
+            yield transcripts.popleft().result()
+    finally:
+        for transcript in transcripts:
+            transcript.cancel()
+
+
+def iter_speech_to_text(engine_id, audio, language_code):
+    """
+    Yields the transcript so far each time the next chunk of the recording is
+    transcribed. The last one is the full transcript.
+    """
+    engine, engine_name = get_engine(engine_id, language_code)
+
     try:
-        engine = engine_class(api_key, language_code)
-        recognized_text = engine.recognize(audio)
+        recognized_text = ""
+        for text in transcribe_chunks(engine, split_audio(audio)):
+            recognized_text = merge_transcripts(recognized_text, text)
+            yield recognized_text
         if not recognized_text:
             raise ValueError("No text recognized in the audio")
-        return recognized_text
     except Exception as e:
         print(f"Failed to transcribe speech with {engine_name} engine: {e}")
         raise ValueError(
             f"[Speech to Text] Failed to transcribe speech with {engine_name} engine: {e}"
         )
+
+
+async def aiter_speech_to_text(engine_id, audio, language_code):
+    """
+    Async version of iter_speech_to_text, which runs in a worker thread between
+    the transcripts it yields.
+    """
+    transcripts = iter_speech_to_text(engine_id, audio, language_code)
+    next_transcript = sync_to_async(next, thread_sensitive=False)
+    try:
+        while True:
+            transcript = await next_transcript(transcripts, None)
+            if transcript is None:
+                return
+            yield transcript
+    finally:
+        # cancels the chunks not transcribed yet if the client went away
+        await sync_to_async(transcripts.close, thread_sensitive=False)()
+
+
+def speech_to_text(engine_id, audio, language_code):
+    recognized_text = ""
+    for recognized_text in iter_speech_to_text(engine_id, audio, language_code):
+        pass
+    return recognized_text
+
+
+def create_transcript_event(transcript, stop, error=False, stats=None):
+    json_data = {
+        "transcript": transcript,
+        "stop": stop,
+        "error": error,
+        "stats": stats,
+    }
+
+    return "data: " + json.dumps(json_data) + "\n\n"
+
+
+def stream_transcript(engine_id, audio, language_code, stats=None, on_error=None):
+    """
+    Sends the transcript so far each time a chunk of the audio is transcribed.
+    `on_error` turns an exception into the message of the error event.
+    """
+    if stats is not None:
+        stats["transcript_start_time"] = time.time()
+    try:
+        transcript = ""
+        for transcript in iter_speech_to_text(engine_id, audio, language_code):
+            yield create_transcript_event(transcript, False)
+        if stats is not None:
+            stats["transcript_end_time"] = time.time()
+        yield create_transcript_event(transcript, True, stats=stats)
+    except Exception as e:
+        error_msg = on_error(e) if on_error else str(e)
+        yield create_transcript_event(error_msg, True, error=True)
+
+
+async def astream_transcript(
+    engine_id, audio, language_code, stats=None, on_error=None
+):
+    """Async version of stream_transcript, `on_error` is run in a thread."""
+    if stats is not None:
+        stats["transcript_start_time"] = time.time()
+    try:
+        transcript = ""
+        async for transcript in aiter_speech_to_text(engine_id, audio, language_code):
+            yield create_transcript_event(transcript, False)
+        if stats is not None:
+            stats["transcript_end_time"] = time.time()
+        yield create_transcript_event(transcript, True, stats=stats)
+    except Exception as e:
+        error_msg = await sync_to_async(on_error)(e) if on_error else str(e)
+        yield create_transcript_event(error_msg, True, error=True)
+
+
+def get_transcript_response(
+    engine_id, audio, language_code, asynchronous=False, stats=None, on_error=None
+):
+    """Streams the transcript of the audio as server-sent events."""
+    # ASGI buffers sync iterators, it only streams async ones
+    stream = astream_transcript if asynchronous else stream_transcript
+    return StreamingHttpResponse(
+        stream(engine_id, audio, language_code, stats, on_error),
+        content_type="text/event-stream",
+    )
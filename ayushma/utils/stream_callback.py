@@ -1,3 +1,4 @@
+import time
 from typing import Any, Dict, List, Union
 
 from langchain.callbacks.base import BaseCallbackHandler
@@ -5,21 +6,51 @@ from langchain.schema import AgentAction, AgentFinish, LLMResult
 
 
 class StreamingQueueCallbackHandler(BaseCallbackHandler):
-    """Callback handler for streaming to Queue."""
+    """Callback handler for streaming to Queue.
 
-    def __init__(self, q, end, error):
+    Works with both ``queue.Queue`` and ``asyncio.Queue``; items are pushed with
+    ``put_nowait`` and the handler runs inline in the event loop.
+
+    Tokens are coalesced into a single queue item until ``flush_size`` bytes have
+    been buffered or ``flush_interval`` seconds have passed since the last flush.
+    With the defaults of 0 every token is pushed as soon as it arrives.
+    """
+
+    run_inline = True
+
+    def __init__(self, q, end, error, flush_interval=0, flush_size=0):
         self.q = q
         self.end = end
         self.error = error
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.buffer = ""
+        self.last_flush = time.monotonic()
+
+    def flush(self) -> None:
+        """Push the buffered tokens to the Queue as one chunk."""
+        if self.buffer:
+            self.q.put_nowait((self.buffer,))
+            self.buffer = ""
+        self.last_flush = time.monotonic()
 
     def on_llm_new_token(self, token: str, **kwargs) -> None:
         """Run on new LLM token. Streams to Queue."""
-        for char in token:
-            self.q.put((char,))
+        self.buffer += token
+        if not self.flush_size and not self.flush_interval:
+            self.flush()
+        elif self.flush_size and len(self.buffer.encode()) >= self.flush_size:
+            self.flush()
+        elif (
+            self.flush_interval
+            and time.monotonic() - self.last_flush >= self.flush_interval
+        ):
+            self.flush()
 
     def on_llm_end(self, response: LLMResult, **kwargs) -> None:
         """Finish the Queue when the LLM is done."""
-        self.q.put((self.end,))
+        self.flush()
+        self.q.put_nowait((self.end,))
 
     def on_llm_start(
         self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any
@@ -31,7 +62,7 @@ class StreamingQueueCallbackHandler(BaseCallbackHandler):
     ) -> None:
         """Run when LLM errors."""
         print("LLM ERROR", error)
-        self.q.put((self.error, error))
+        self.q.put_nowait((self.error, error))
 
     def on_chain_start(
         self, serialized: Dict[str, Any], inputs: Dict[str, Any], **kwargs: Any
@@ -45,7 +76,7 @@ class StreamingQueueCallbackHandler(BaseCallbackHandler):
         self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
     ) -> None:
         """Run when chain errors."""
-        self.q.put((self.error, error))
+        self.q.put_nowait((self.error, error))
 
     def on_tool_start(
         self, serialized: Dict[str, Any], input_str: str, **kwargs: Any
@@ -1,37 +1,250 @@
 import os
-from io import BytesIO
-from typing import Optional
+import re
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Dict, Iterator, Optional, Tuple
 
+import billiard
 import requests
 from bs4 import BeautifulSoup
 from django.conf import settings
+from django.db import connection
 from PyPDF2 import PdfReader
 
-from ayushma.utils.openaiapi import get_embedding
-from ayushma.utils.vectordb import VectorDB
+from ayushma.models.document import Document
+from ayushma.models.enums import DocumentType
+from ayushma.utils.chunker import chunk_text
+from ayushma.utils.embedding_store import get_stored_embedding
+from ayushma.utils.openaiapi import batch_by_tokens, split_tokens
+from ayushma.utils.vectordb import VectorDB, get_chunk_id
+
+# pages extracted by one task of the PDF extraction pool
+PDF_PAGES_PER_TASK = 10
+
+# chunks looked up in the vector db at once, to skip the ones already stored
+EXISTING_IDS_BATCH_SIZE = 1000
+
+# PDF being extracted by a process of the extraction pool
+pdf_reader = None
+
+paragraph_break = re.compile(r"\n\s*\n")
+
+
+def open_pdf(path):
+    global pdf_reader
+    pdf_reader = PdfReader(path)
+
+
+def extract_pdf_pages(start, end, reader=None):
+    reader = reader or pdf_reader
+    return [reader.pages[i].extract_text() for i in range(start, end)]
+
+
+def download_document(url):
+    """Streams the file at `url` to a temporary file and returns its path."""
+    f = tempfile.NamedTemporaryFile(suffix=".pdf", delete=False)
+    try:
+        with f, requests.get(url, stream=True) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                f.write(chunk)
+    except BaseException:
+        os.remove(f.name)
+        raise
+    return f.name
+
+
+def read_pdf_pages(path):
+    """
+    Yields the text of the pages of a PDF in order. Pages are extracted by a pool
+    of processes that open the PDF once each, with at most two batches of pages
+    in flight per process.
+    """
+    reader = PdfReader(path)
+    page_count = len(reader.pages)
+    print(f"Extracting text from {page_count} pages")
+    batches = [
+        (start, min(start + PDF_PAGES_PER_TASK, page_count))
+        for start in range(0, page_count, PDF_PAGES_PER_TASK)
+    ]
+
+    workers = settings.PDF_EXTRACTION_WORKERS
+    if workers <= 1 or len(batches) <= 1:
+        for start, end in batches:
+            yield from extract_pdf_pages(start, end, reader)
+        return
+
+    # billiard, unlike multiprocessing, can start a pool from the daemonic
+    # processes of celery prefork workers
+    with billiard.Pool(workers, initializer=open_pdf, initargs=(path,)) as pool:
+        pending = deque()
+        for start, end in batches:
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().get()
+            pending.append(pool.apply_async(extract_pdf_pages, (start, end)))
+        while pending:
+            yield from pending.popleft().get()
 
 
 def read_document(url):
+    """Yields the text of the document at `url`, page by page for PDF files."""
     filename = os.path.basename(url.split("?")[0])
     if filename.endswith(".pdf"):  # Handle pdf files
         print("PDF file detected")
-        response = requests.get(url)
-        print(response)
-        pdf_reader = PdfReader(BytesIO(response.content))
-        text = ""
-        for i in range(len(pdf_reader.pages)):
-            page = pdf_reader.pages[i]
-            text += page.extract_text()
-        document_text = text
+        path = download_document(url)
+        try:
+            yield from read_pdf_pages(path)
+        finally:
+            os.remove(path)
     else:  # Handle txt and md files
         if url.startswith("http"):
             response = requests.get(url)
-            document_text = response.text
+            yield response.text
         else:
             with open(os.path.join(settings.MEDIA_ROOT, "documents", url), "r") as f:
-                document_text = f.read()
+                yield f.read()
+
+
+def get_document_pages(
+    s3_url: Optional[str] = None,
+    url: Optional[str] = None,
+    text: Optional[str] = None,
+) -> Iterator[str]:
+    if s3_url:
+        yield from read_document(s3_url)
+    elif url:
+        html = requests.get(url).text
+        soup = BeautifulSoup(html, "html.parser")
+        yield soup.get_text()
+    elif text:
+        yield text
+    else:
+        raise Exception("Either filepath, url or text must be provided")
+
+
+def get_document_source(document, document_url: Optional[str] = None) -> dict:
+    """Returns the `upsert` arguments that point to the content of a document."""
+    if document.document_type == DocumentType.FILE:
+        url = document_url or document.file.url
+        if not url.startswith("http"):
+            url = settings.CURRENT_DOMAIN + url
+        return {"s3_url": url}
+    elif document.document_type == DocumentType.URL:
+        return {"url": document.text_content}
+    elif document.document_type == DocumentType.TEXT:
+        return {"text": document.text_content}
+    else:
+        raise Exception("Invalid document type.")
+
+
+def iter_document_chunks(
+    strategy: Optional[str] = None, **source
+) -> Iterator[Tuple[str, int]]:
+    """
+    Chunks a document as its pages are read and yields each chunk with its number
+    of tokens, in the order of the document. The last paragraph of a page is
+    chunked with the next page, which may continue it.
+    """
+
+    def chunks_of(text):
+        for chunk in chunk_text(text, strategy):
+            # chunks that do not fit in an embedding request are split further
+            yield from split_tokens(chunk)
+
+    rest = ""
+    for page in get_document_pages(**source):
+        text = f"{rest}\n{page}" if rest else page
+        breaks = list(paragraph_break.finditer(text))
+        if not breaks:
+            rest = text
+            continue
+        yield from chunks_of(text[: breaks[-1].start()])
+        rest = text[breaks[-1].end() :]
+    if rest.strip():
+        yield from chunks_of(rest)
+
+
+def get_document_chunks(strategy: Optional[str] = None, **source) -> Dict[str, int]:
+    """
+    Returns the number of tokens of each chunk of a document, in the order of the
+    document and without repeats. Holds the whole document in memory, `upsert`
+    streams it with iter_document_chunks instead.
+    """
+    chunks = {}
+    for chunk, tokens in iter_document_chunks(strategy, **source):
+        chunks.setdefault(chunk, tokens)
+    return chunks
+
+
+class RateLimiter:
+    """
+    Spaces out calls to at most `per_minute` calls and `tokens_per_minute` tokens
+    per minute (0 disables a limit).
+    """
+
+    def __init__(self, per_minute, tokens_per_minute=0):
+        self.interval = 60 / per_minute if per_minute else 0
+        self.token_interval = 60 / tokens_per_minute if tokens_per_minute else 0
+        self.next_call = 0
+        self.lock = threading.Lock()
+
+    def wait(self, tokens=0):
+        interval = max(self.interval, tokens * self.token_interval)
+        if not interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def embed_batches(batches):
+    """
+    Yields (batch, embeddings, requested) for batches of (id, chunk, tokens) in
+    order, with up to EMBEDDING_CONCURRENCY embedding requests in flight.
+    `requested` are the chunks that were not in the embedding store and were
+    sent to the API.
+    """
+    concurrency = max(settings.EMBEDDING_CONCURRENCY, 1)
+    rate_limiter = RateLimiter(
+        settings.EMBEDDING_REQUESTS_PER_MINUTE, settings.EMBEDDING_TOKENS_PER_MINUTE
+    )
+
+    def embed(batch):
+        tokens = {chunk: tokens for _, chunk, tokens in batch}
+        requested = []
+
+        def before_request(texts):
+            # only requests for chunks missing from the embedding store count
+            requested.extend(texts)
+            rate_limiter.wait(sum(tokens[text] for text in texts))
 
-    return document_text
+        try:
+            embeddings = get_stored_embedding(
+                list(tokens), before_request=before_request
+            )
+            return embeddings, requested
+        finally:
+            # this runs in its own thread, which has its own database connection
+            connection.close()
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    pending = deque()
+    try:
+        for batch in batches:
+            if len(pending) >= concurrency:
+                yield (pending[0][0], *pending.popleft()[1].result())
+            pending.append((batch, executor.submit(embed, batch)))
+        while pending:
+            yield (pending[0][0], *pending.popleft()[1].result())
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
 
 
 def upsert(
@@ -40,6 +253,7 @@ def upsert(
     s3_url: Optional[str] = None,
     url: Optional[str] = None,
     text: Optional[str] = None,
+    force: bool = False,
 ):
     """
     Upserts the contents of a file, URL, or text to a vector index with the specified external ID.
@@ -50,57 +264,117 @@ def upsert(
         s3_url (str, optional): The S3 URL of the file to upsert. Defaults to None.
         url (str, optional): The URL of the website to upsert. Defaults to None.
         text (str, optional): The text content to upsert. Defaults to None.
+        force (bool, optional): Write every chunk, including the ones already in the
+            vector index, e.g. after changing the embedding model. Defaults to False.
 
     Raises:
         Exception: If none of s3_url, url, or text is provided.
 
     Returns:
-        None
+        dict: The number of chunks in the document and of new chunks written, of
+            chunks and tokens embedded by the API and of chunks read from the
+            embedding store.
     """
 
     print("Processing...")
 
-    document_lines = []
+    subject = str(document_id)
+    partition_name = str(external_id).replace("-", "_")
+    vector_db = VectorDB()
 
-    if s3_url:
-        document_text = read_document(s3_url)
-        document_lines = document_text.strip().splitlines()
-    elif url:
-        html = requests.get(url).text
-        soup = BeautifulSoup(html, "html.parser")
-        document_lines = soup.get_text().strip().splitlines()
+    # the chunks are embedded and written as the document is read, only their
+    # ids are kept for the whole document
+    ids = set()
+    new = 0
 
-    elif text:
-        document_lines = text.strip().splitlines()
-    else:
-        raise Exception("Either filepath, url or text must be provided")
-
-    if len(document_lines) == 0:
-        raise Exception(
-            "[Upsert] No text found in the document. Please check the document."
-        )
-    print(document_lines)
+    def new_chunks():
+        nonlocal new
+        chunks = iter_document_chunks(s3_url=s3_url, url=url, text=text)
+        while batch := list(islice(chunks, EXISTING_IDS_BATCH_SIZE)):
+            items = []
+            for chunk, tokens in batch:
+                # identical chunks share an id, so only keep the first occurrence
+                id = get_chunk_id(subject, chunk)
+                if id not in ids:
+                    ids.add(id)
+                    items.append((id, chunk, tokens))
+            existing_ids = set()
+            if items and not force:
+                existing_ids = vector_db.get_existing_ids(
+                    [id for id, _, _ in items], partition_name
+                )
+            for item in items:
+                if item[0] not in existing_ids:
+                    new += 1
+                    yield item
 
-    batch_size = (
-        100  # process everything in batches of 100 (creates 100 vectors per upset)
-    )
+    batches = batch_by_tokens(new_chunks(), count=lambda item: item[2])
+    embedded = 0
+    tokens = 0
 
     print("Upserting to vector collection...")
 
-    for i in range(0, len(document_lines), batch_size):
-        lines_batch = document_lines[i : i + batch_size]  # get batch of lines and IDs
-        lines_batch = [
-            line.strip() for line in lines_batch if line.strip()
-        ]  # remove blank lines
+    def write(rows):
+        vector_db.insert(
+            vectors=[vector for _, _, vector in rows],
+            texts=[chunk for _, chunk, _ in rows],
+            subject=subject,
+            partition_name=partition_name,
+            ids=[id for id, _, _ in rows],
+        )
 
-        embeds = get_embedding(lines_batch)
-        partition_name = str(external_id).replace("-", "_")
+    # embeddings are requested concurrently while the previous rows are written
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        pending_write = None
+        rows = []
+        for batch, embeds, requested in embed_batches(batches):
+            chunk_tokens = {chunk: count for _, chunk, count in batch}
+            embedded += len(requested)
+            tokens += sum(chunk_tokens[chunk] for chunk in requested)
+            rows += [
+                (id, chunk, vector) for (id, chunk, _), vector in zip(batch, embeds)
+            ]
+            if len(rows) >= settings.VECTOR_DB_WRITE_BATCH_SIZE:
+                if pending_write:
+                    pending_write.result()
+                pending_write = writer.submit(write, rows)
+                rows = []
+        if pending_write:
+            pending_write.result()
+        if rows:
+            write(rows)
 
-        VectorDB().insert(
-            vectors=embeds,
-            texts=lines_batch,
-            subject=str(document_id),
-            partition_name=partition_name,
+    if not ids:
+        raise Exception(
+            "[Upsert] No text found in the document. Please check the document."
         )
+    print(f"Split document into {len(ids)} chunks, {new} new")
+
+    # remove the chunks that are no longer part of the document
+    stale_ids = vector_db.get_subject_ids(subject, partition_name) - ids
+    if stale_ids:
+        print(f"Removing {len(stale_ids)} chunks no longer in the document")
+        vector_db.delete_subject(subject, partition_name, ids=stale_ids)
 
     print("Finished upserting to vectorDB")
+    return {
+        "chunks": len(ids),
+        "new": new,
+        "embedded": embedded,
+        "tokens": tokens,
+        "stored": new - embedded,
+    }
+
+
+def reindex_document(document_id: str, force: bool = False) -> dict:
+    """
+    Upserts a document again, e.g. after changing the chunker or vector db, or
+    with `force` after changing the embedding model.
+    """
+    document = Document.objects.select_related("project").get(external_id=document_id)
+    return upsert(
+        external_id=document.project.external_id,
+        document_id=document.external_id,
+        force=force,
+        **get_document_source(document),
+    )
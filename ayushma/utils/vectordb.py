@@ -1,10 +1,35 @@
+import fcntl
+import hashlib
 import json
+import os
+import shutil
+import threading
+import time
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from uuid import uuid4
 
+import numpy as np
 from django.conf import settings
 from pinecone import Pinecone
 from pymilvus import MilvusClient
 
+PINECONE_UPSERT_BATCH_SIZE = 100
+# ids per delete request, pinecone accepts at most 1000
+DELETE_BATCH_SIZE = 1000
+# most results of a milvus query and of a pinecone query without metadata
+MILVUS_QUERY_LIMIT = 16384
+PINECONE_QUERY_LIMIT = 10000
+
+
+def get_chunk_id(subject, text) -> int:
+    """
+    Deterministic id of a chunk of text in a document, so that re-upserting a
+    document only has to write the chunks that changed. Fits a signed int64.
+    """
+    digest = hashlib.sha256(f"{subject}\n{text}".encode()).digest()
+    return int.from_bytes(digest[:8], "big") >> 1
+
 
 class AbstractVectorDB(ABC):
 
@@ -22,7 +47,11 @@ class AbstractVectorDB(ABC):
         pass
 
     @abstractmethod
-    def insert(self, vectors, texts, subject, partition_name):
+    def insert(self, vectors, texts, subject, partition_name, ids=None):
+        pass
+
+    @abstractmethod
+    def get_existing_ids(self, ids, partition_name):
         pass
 
     @abstractmethod
@@ -38,7 +67,11 @@ class AbstractVectorDB(ABC):
         pass
 
     @abstractmethod
-    def delete_subject(self, subject, partition_name):
+    def get_subject_ids(self, subject, partition_name):
+        pass
+
+    @abstractmethod
+    def delete_subject(self, subject, partition_name, ids=None):
         pass
 
     @abstractmethod
@@ -53,30 +86,63 @@ class MilvusVectorDB(AbstractVectorDB):
         self.client = MilvusClient(
             uri=settings.MILVUS_URL,
         )
+        # partitions known to exist, refreshed from milvus once the TTL expires
+        self.partitions = set()
+        self.partitions_fetched_at = 0
+        self.partitions_lock = threading.Lock()
         self.get_or_create_collection()
 
     def get_or_create_partition(self, partition_name: str):
-        partitions = self.client.list_partitions(collection_name=self.collection_name)
-        if partition_name not in partitions:
-            self.client.create_partition(
-                collection_name=self.collection_name, partition_name=partition_name
+        if (
+            partition_name in self.partitions
+            and time.monotonic() - self.partitions_fetched_at
+            < settings.VECTOR_DB_METADATA_TTL
+        ):
+            return
+
+        with self.partitions_lock:
+            self.partitions = set(
+                self.client.list_partitions(collection_name=self.collection_name)
             )
+            self.partitions_fetched_at = time.monotonic()
+            if partition_name not in self.partitions:
+                self.client.create_partition(
+                    collection_name=self.collection_name, partition_name=partition_name
+                )
+                self.partitions.add(partition_name)
 
-    def insert(self, vectors, texts, subject, partition_name):
+    def insert(self, vectors, texts, subject, partition_name, ids=None):
 
         self.get_or_create_partition(partition_name)
 
+        if ids is None:
+            ids = [get_chunk_id(subject, text) for text in texts]
+
         data = [
-            {"id": i, "vector": vectors[i], "text": texts[i], "subject": subject}
+            {"id": ids[i], "vector": vectors[i], "text": texts[i], "subject": subject}
             for i in range(len(vectors))
         ]
 
-        self.client.insert(
+        self.client.upsert(
             collection_name=self.collection_name,
             data=data,
             partition_name=partition_name,
         )
 
+    def get_existing_ids(self, ids, partition_name):
+        self.get_or_create_partition(partition_name)
+
+        existing = set()
+        for i in range(0, len(ids), 1000):
+            results = self.client.get(
+                collection_name=self.collection_name,
+                ids=list(ids[i : i + 1000]),
+                output_fields=["id"],
+                partition_names=[partition_name],
+            )
+            existing.update(result["id"] for result in results)
+        return existing
+
     def get_or_create_collection(self, collection_name: str = None):
         if collection_name is None:
             collection_name = self.collection_name
@@ -119,13 +185,45 @@ class MilvusVectorDB(AbstractVectorDB):
         self.client.drop_partition(
             collection_name=self.collection_name, partition_name=partition_name
         )
+        self.partitions.discard(partition_name)
 
-    def delete_subject(self, subject, partition_name):
-        self.client.delete(
-            collection_name=self.collection_name,
-            partition_name=partition_name,
-            filter='subject in ["' + str(subject) + '"]',
-        )
+    def get_subject_ids(self, subject, partition_name):
+        self.get_or_create_partition(partition_name)
+
+        # results of a query with a limit are sorted by id, so they are paged
+        # through by id
+        filter = 'subject in ["' + str(subject) + '"]'
+        ids = set()
+        last_id = None
+        while True:
+            results = self.client.query(
+                collection_name=self.collection_name,
+                filter=filter if last_id is None else f"{filter} and id > {last_id}",
+                output_fields=["id"],
+                partition_names=[partition_name],
+                limit=MILVUS_QUERY_LIMIT,
+            )
+            ids.update(result["id"] for result in results)
+            if len(results) < MILVUS_QUERY_LIMIT:
+                return ids
+            last_id = max(result["id"] for result in results)
+
+    def delete_subject(self, subject, partition_name, ids=None):
+        filter = 'subject in ["' + str(subject) + '"]'
+        if ids is None:
+            self.client.delete(
+                collection_name=self.collection_name,
+                partition_name=partition_name,
+                filter=filter,
+            )
+            return
+        ids = [int(id) for id in ids]
+        for i in range(0, len(ids), DELETE_BATCH_SIZE):
+            self.client.delete(
+                collection_name=self.collection_name,
+                partition_name=partition_name,
+                filter=f"{filter} and id in {json.dumps(ids[i : i + DELETE_BATCH_SIZE])}",
+            )
 
 
 class PineconeVectorDB(AbstractVectorDB):
@@ -136,19 +234,37 @@ class PineconeVectorDB(AbstractVectorDB):
             api_key=settings.PINECONE_API_KEY,
         )
         self.get_or_create_collection()
+        self.index = self.client.Index(self.collection_name)
 
     def get_or_create_partition(self, partition_name):
         pass
 
-    def insert(self, vectors, texts, subject, partition_name):
-        meta = [{"text": texts[i], "document": subject} for i in range(len(vectors))]
-        ids = [str(i) for i in range(len(vectors))]
-        data = zip(ids, vectors, meta)
+    def insert(self, vectors, texts, subject, partition_name, ids=None):
+        if ids is None:
+            ids = [get_chunk_id(subject, text) for text in texts]
 
-        self.client.Index(self.collection_name).upsert(
-            vectors=data,
-            namespace=partition_name,
-        )
+        meta = [
+            {"text": texts[i], "document": subject, "id": str(ids[i])}
+            for i in range(len(vectors))
+        ]
+        data = list(zip([str(id) for id in ids], vectors, meta))
+
+        # requests are limited to 2MB, about 100 vectors with their text
+        for i in range(0, len(data), PINECONE_UPSERT_BATCH_SIZE):
+            self.index.upsert(
+                vectors=data[i : i + PINECONE_UPSERT_BATCH_SIZE],
+                namespace=partition_name,
+            )
+
+    def get_existing_ids(self, ids, partition_name):
+        existing = set()
+        for i in range(0, len(ids), 1000):
+            response = self.index.fetch(
+                ids=[str(id) for id in ids[i : i + 1000]],
+                namespace=partition_name,
+            )
+            existing.update(int(id) for id in response.vectors.keys())
+        return existing
 
     def get_or_create_collection(self, collection_name=None):
         if collection_name is None:
@@ -163,8 +279,7 @@ class PineconeVectorDB(AbstractVectorDB):
             )
 
     def search(self, embeddings, partition_name, limit=None):
-        index = self.client.Index(self.collection_name)
-        result = index.query(
+        result = self.index.query(
             vector=embeddings,
             namespace=partition_name,
             top_k=limit or self.top_k,
@@ -189,27 +304,300 @@ class PineconeVectorDB(AbstractVectorDB):
         return json.dumps(sanitized_reference)
 
     def delete_partition(self, partition_name):
-        index = self.client.Index(self.collection_name)
-        index.delete(namespace=partition_name, deleteAll=True)
+        self.index.delete(namespace=partition_name, deleteAll=True)
 
-    def delete_subject(self, subject, partition_name):
-        index = self.client.Index(self.collection_name)
-        index.delete(
+    def get_subject_ids(self, subject, partition_name):
+        # vectors cannot be listed by metadata, but every vector of the subject
+        # matches a query under its filter
+        result = self.index.query(
+            vector=[1.0] + [0.0] * (self.dimensions - 1),
             namespace=partition_name,
+            top_k=PINECONE_QUERY_LIMIT,
             filter={"document": subject},
         )
+        if len(result.matches) == PINECONE_QUERY_LIMIT:
+            print(
+                f"Only the first {PINECONE_QUERY_LIMIT} chunks of {subject} are "
+                "checked for removed chunks"
+            )
+        return {int(match.id) for match in result.matches}
+
+    def delete_subject(self, subject, partition_name, ids=None):
+        if ids is None:
+            self.index.delete(
+                namespace=partition_name,
+                filter={"document": subject},
+            )
+            return
+        ids = [str(id) for id in ids]
+        for i in range(0, len(ids), DELETE_BATCH_SIZE):
+            self.index.delete(
+                ids=ids[i : i + DELETE_BATCH_SIZE],
+                namespace=partition_name,
+            )
+
+
+class LocalVectorDB(AbstractVectorDB):
+    """
+    In-process vector store for small projects and offline use.
+
+    Each partition is a directory of immutable segments, a float32 `<name>.npy`
+    matrix of normalised embeddings (memory-mapped on read) and a `<name>.json`
+    list with the id, text and subject of every row, and a `manifest.json` listing
+    the live segments. Inserts add a segment and replace the manifest, so a write
+    costs the size of the batch rather than of the partition. Search is a brute
+    force cosine similarity.
+
+    Writers hold an exclusive `flock` on the partition and readers a shared one,
+    which covers the threads and processes (web, celery) sharing the directory.
+    """
+
+    collection_name = settings.LOCAL_VECTOR_DB_COLLECTION
+    sanitize = MilvusVectorDB.sanitize
+
+    def initialize(self) -> None:
+        self.path = settings.LOCAL_VECTOR_DB_PATH
+        # partition name -> (segment names, vectors, meta)
+        self.partitions = {}
+        self.get_or_create_collection()
+
+    def get_partition_path(self, partition_name):
+        return os.path.join(self.path, self.collection_name, partition_name)
+
+    def get_or_create_partition(self, partition_name: str):
+        os.makedirs(self.get_partition_path(partition_name), exist_ok=True)
+
+    def get_or_create_collection(self, collection_name: str = None):
+        if collection_name is None:
+            collection_name = self.collection_name
+        os.makedirs(os.path.join(self.path, collection_name), exist_ok=True)
+
+    @contextmanager
+    def lock_partition(self, partition_name, exclusive=True):
+        # next to the partition so it survives delete_partition
+        with open(self.get_partition_path(partition_name) + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def read_manifest(self, path):
+        """[name, rows] of the live segments of a partition, oldest first."""
+        try:
+            with open(os.path.join(path, "manifest.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def write_manifest(self, path, segments):
+        with open(os.path.join(path, "manifest.json.tmp"), "w") as f:
+            json.dump(segments, f)
+        os.replace(
+            os.path.join(path, "manifest.json.tmp"), os.path.join(path, "manifest.json")
+        )
+
+    def read_segment(self, path, name):
+        vectors = np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+        with open(os.path.join(path, f"{name}.json")) as f:
+            return vectors, json.load(f)
+
+    def write_segment(self, path, vectors, meta):
+        # segments are only used once they are in the manifest, a partial one
+        # left behind by a crash is never read
+        name = uuid4().hex
+        np.save(os.path.join(path, f"{name}.npy"), vectors)
+        with open(os.path.join(path, f"{name}.json"), "w") as f:
+            json.dump(meta, f)
+        return [name, len(meta)]
+
+    def remove_segments(self, path, names):
+        for name in names:
+            for extension in ("npy", "json"):
+                try:
+                    os.remove(os.path.join(path, f"{name}.{extension}"))
+                except FileNotFoundError:
+                    pass
+
+    def read_segments(self, path, segments):
+        """Rows of the segments, the latest of each id only."""
+        if not segments:
+            return np.zeros((0, self.dimensions), dtype=np.float32), []
+
+        loaded = [self.read_segment(path, name) for name, _ in segments]
+        if len(loaded) == 1:
+            vectors, meta = loaded[0]
+        else:
+            vectors = np.concatenate([vectors for vectors, _ in loaded], axis=0)
+            meta = [row for _, rows in loaded for row in rows]
+
+        # an upsert adds a new row instead of rewriting the segment of the old one
+        latest = {row.get("id"): i for i, row in enumerate(meta)}
+        if len(latest) < len(meta):
+            keep = sorted(latest.values())
+            vectors = vectors[keep]
+            meta = [meta[i] for i in keep]
+        return vectors, meta
+
+    def load_partition(self, partition_name):
+        path = self.get_partition_path(partition_name)
+        if not os.path.isdir(path):
+            return np.zeros((0, self.dimensions), dtype=np.float32), []
+
+        with self.lock_partition(partition_name, exclusive=False):
+            segments = self.read_manifest(path)
+            names = [name for name, _ in segments]
+            cached = self.partitions.get(partition_name)
+            if cached and cached[0] == names:
+                return cached[1], cached[2]
+            vectors, meta = self.read_segments(path, segments)
+
+        self.partitions[partition_name] = (names, vectors, meta)
+        return vectors, meta
+
+    def normalize(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimensions)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    def insert(self, vectors, texts, subject, partition_name, ids=None):
+        if ids is None:
+            ids = [get_chunk_id(subject, text) for text in texts]
+
+        self.get_or_create_partition(partition_name)
+        path = self.get_partition_path(partition_name)
+        meta = [
+            {"id": ids[i], "text": texts[i], "subject": subject}
+            for i in range(len(vectors))
+        ]
+        with self.lock_partition(partition_name):
+            segments = self.read_manifest(path)
+            segments.append(self.write_segment(path, self.normalize(vectors), meta))
+
+            # merge the newest segment into the one before while that one is not
+            # larger, like a binary counter: a row is rewritten O(log n) times and
+            # a partition has O(log n) segments
+            removed = []
+            while len(segments) > 1 and segments[-2][1] <= segments[-1][1]:
+                merged = segments[-2:]
+                segments[-2:] = [
+                    self.write_segment(path, *self.read_segments(path, merged))
+                ]
+                removed += [name for name, _ in merged]
+
+            self.write_manifest(path, segments)
+            self.remove_segments(path, removed)
+
+    def get_existing_ids(self, ids, partition_name):
+        _, meta = self.load_partition(partition_name)
+        stored = {row.get("id") for row in meta}
+        return {id for id in ids if id in stored}
+
+    def search(self, embeddings, partition_name, limit=None):
+        vectors, meta = self.load_partition(partition_name)
+        if len(meta) == 0:
+            return []
+
+        limit = min(limit or self.top_k, len(meta))
+        # best cosine similarity of each row against any of the query embeddings
+        scores = (vectors @ self.normalize(embeddings).T).max(axis=1)
+        if limit < len(meta):
+            top = np.argpartition(-scores, limit - 1)[:limit]
+        else:
+            top = np.arange(len(meta))
+        top = top[np.argsort(-scores[top])]
+
+        return [
+            {
+                "id": meta[i].get("id", int(i)),
+                "distance": float(scores[i]),
+                "entity": meta[i],
+            }
+            for i in top
+        ]
+
+    def delete_partition(self, partition_name):
+        with self.lock_partition(partition_name):
+            shutil.rmtree(self.get_partition_path(partition_name), ignore_errors=True)
+            self.partitions.pop(partition_name, None)
+
+    def get_subject_ids(self, subject, partition_name):
+        _, meta = self.load_partition(partition_name)
+        return {row.get("id") for row in meta if row["subject"] == str(subject)}
+
+    def delete_subject(self, subject, partition_name, ids=None):
+        ids = None if ids is None else set(ids)
+        path = self.get_partition_path(partition_name)
+        if not os.path.isdir(path):
+            return
+
+        with self.lock_partition(partition_name):
+            # only the segments holding rows of the subject are rewritten
+            segments = []
+            removed = []
+            for name, rows in self.read_manifest(path):
+                vectors, meta = self.read_segment(path, name)
+                keep = [
+                    i
+                    for i, row in enumerate(meta)
+                    if row["subject"] != str(subject)
+                    or (ids is not None and row.get("id") not in ids)
+                ]
+                if len(keep) == len(meta):
+                    segments.append([name, rows])
+                    continue
+                removed.append(name)
+                if keep:
+                    segments.append(
+                        self.write_segment(
+                            path,
+                            np.asarray(vectors[keep], dtype=np.float32),
+                            [meta[i] for i in keep],
+                        )
+                    )
+            if not removed:
+                return
+
+            self.write_manifest(path, segments)
+            self.remove_segments(path, removed)
 
 
 class VectorDB:
+    """
+    Proxy to the configured vector database.
+
+    The underlying client is created lazily once per process and shared between
+    threads, so constructing a `VectorDB` is cheap and does not open a connection.
+    """
+
+    _vector_db = None
+    _vector_db_pid = None
+    _lock = threading.Lock()
+
     def __init__(self):
-        vector_db_type = settings.VECTOR_DB.lower()
-        if vector_db_type == "milvus":
-            self.vector_db = MilvusVectorDB()
-        elif vector_db_type == "pinecone":
-            self.vector_db = PineconeVectorDB()
-        else:
-            raise ValueError(f"Unsupported VECTOR_DB type: {settings.VECTOR_DB}")
-        self.vector_db.initialize()
+        self.vector_db = self.get_vector_db()
+
+    @classmethod
+    def get_vector_db(cls) -> AbstractVectorDB:
+        with cls._lock:
+            # clients must not be shared across forked processes (celery, gunicorn)
+            if cls._vector_db is None or cls._vector_db_pid != os.getpid():
+                vector_db_type = settings.VECTOR_DB.lower()
+                if vector_db_type == "milvus":
+                    vector_db = MilvusVectorDB()
+                elif vector_db_type == "pinecone":
+                    vector_db = PineconeVectorDB()
+                elif vector_db_type == "local":
+                    vector_db = LocalVectorDB()
+                else:
+                    raise ValueError(
+                        f"Unsupported VECTOR_DB type: {settings.VECTOR_DB}"
+                    )
+                vector_db.initialize()
+                cls._vector_db = vector_db
+                cls._vector_db_pid = os.getpid()
+            return cls._vector_db
 
     def __getattr__(self, name):
         return getattr(self.vector_db, name)
@@ -1,6 +1,8 @@
 import time
 
 from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.shortcuts import get_object_or_404
 from drf_spectacular.utils import extend_schema
 from rest_framework import filters, status
 from rest_framework.decorators import action
@@ -18,7 +20,7 @@ from rest_framework.response import Response
 from ayushma.models import Chat, ChatFeedback, Project
 from ayushma.models.chat import ChatMessage
 from ayushma.models.enums import ChatMessageType
-from ayushma.permissions import IsTempTokenOrAuthenticated
+from ayushma.permissions import HasSignedAudioUrl, IsTempTokenOrAuthenticated
 from ayushma.serializers import (
     ChatDetailSerializer,
     ChatFeedbackSerializer,
@@ -26,8 +28,12 @@ from ayushma.serializers import (
     ConverseSerializer,
     SpeechToTextSerializer,
 )
+from ayushma.utils.audio_stream import (
+    get_message_audio_response,
+    is_audio_url_signed,
+)
 from ayushma.utils.converse import converse_api
-from ayushma.utils.speech_to_text import speech_to_text
+from ayushma.utils.speech_to_text import get_transcript_response, speech_to_text
 from utils.views.base import BaseModelViewSet
 from utils.views.mixins import PartialUpdateModelMixin
 
@@ -142,27 +148,27 @@ class ChatViewSet(
                 {"error": "Project not found"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
+
+        if serializer.validated_data.get("stream"):
+            return get_transcript_response(
+                stt_engine,
+                audio,
+                language + "-IN",
+                asynchronous=isinstance(self.request._request, ASGIRequest),
+                stats=stats,
+                on_error=lambda e: self.save_transcription_error(
+                    stt_engine, kwarg["external_id"], language, e
+                ),
+            )
+
         try:
             stats["transcript_start_time"] = time.time()
             transcript = speech_to_text(stt_engine, audio, language + "-IN")
             stats["transcript_end_time"] = time.time()
             translated_text = transcript
         except Exception as e:
-            print(f"Failed to transcribe speech with {stt_engine} engine:\n{e}")
-
-            error_msg = (
-                f"[Transcribing] Something went wrong in getting transcription.\n{e}"
-            )
-            chat = Chat.objects.get(external_id=kwarg["external_id"])
-            chat.title = "Transcription Error"
-            chat.save()
-            ChatMessage.objects.create(
-                message=error_msg,
-                original_message=error_msg,
-                chat=chat,
-                messageType=ChatMessageType.SYSTEM,
-                language=language,
-                meta={},
+            error_msg = self.save_transcription_error(
+                stt_engine, kwarg["external_id"], language, e
             )
 
             return Response(
@@ -175,6 +181,53 @@ class ChatViewSet(
             status=status.HTTP_200_OK,
         )
 
+    def save_transcription_error(self, stt_engine, chat_external_id, language, e):
+        print(f"Failed to transcribe speech with {stt_engine} engine:\n{e}")
+
+        error_msg = (
+            f"[Transcribing] Something went wrong in getting transcription.\n{e}"
+        )
+        chat = Chat.objects.get(external_id=chat_external_id)
+        chat.title = "Transcription Error"
+        chat.save()
+        ChatMessage.objects.create(
+            message=error_msg,
+            original_message=error_msg,
+            chat=chat,
+            messageType=ChatMessageType.SYSTEM,
+            language=language,
+            meta={},
+        )
+        return error_msg
+
+    @extend_schema(
+        tags=("chats",),
+    )
+    @action(
+        detail=True,
+        methods=["get"],
+        url_path=r"messages/(?P<message_external_id>[^/.]+)/audio",
+        permission_classes=(HasSignedAudioUrl | IsTempTokenOrAuthenticated,),
+    )
+    def message_audio(self, *args, **kwarg):
+        # signed urls are not tied to the user or api key of the request
+        if is_audio_url_signed(
+            self.request, kwarg["external_id"], kwarg["message_external_id"]
+        ):
+            chat = get_object_or_404(Chat, external_id=kwarg["external_id"])
+        else:
+            chat = self.get_object()
+        response = get_message_audio_response(
+            chat,
+            kwarg["message_external_id"],
+            asynchronous=isinstance(self.request._request, ASGIRequest),
+        )
+        if not response:
+            return Response(
+                {"error": "Audio not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+        return response
+
     @extend_schema(
         tags=("chats",),
     )
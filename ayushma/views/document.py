@@ -13,6 +13,7 @@ from ayushma.models import Document, Project
 from ayushma.models.testsuite import TestQuestion
 from ayushma.serializers.document import DocumentSerializer, DocumentUpdateSerializer
 from ayushma.tasks.upsertdoc import upsert_doc
+from ayushma.utils.answer_cache import invalidate_answer_cache
 from ayushma.utils.vectordb import VectorDB
 from utils.views.base import BaseModelViewSet
 from utils.views.mixins import PartialUpdateModelMixin
@@ -74,6 +75,7 @@ class ProjectDocumentViewSet(
                 partition_name=self.kwargs["project_external_id"].replace("-", "_"),
                 subject=str(instance.external_id),
             )
+            invalidate_answer_cache(instance.project)
             return super().perform_destroy(instance)
         except Exception as e:
             print(e)
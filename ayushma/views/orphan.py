@@ -1,5 +1,5 @@
-import openai
-from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.shortcuts import get_object_or_404
 from drf_spectacular.utils import extend_schema
 from rest_framework import permissions, status
 from rest_framework.decorators import action
@@ -10,9 +10,15 @@ from rest_framework.response import Response
 
 from ayushma.models import APIKey, Chat
 from ayushma.models.enums import STTEngine
+from ayushma.permissions import HasSignedAudioUrl
 from ayushma.serializers import ChatDetailSerializer, ConverseSerializer
+from ayushma.utils.audio_stream import (
+    get_message_audio_response,
+    is_audio_url_signed,
+)
 from ayushma.utils.converse import converse_api
-from ayushma.utils.speech_to_text import speech_to_text
+from ayushma.utils.openai_client import get_openai_client
+from ayushma.utils.speech_to_text import get_transcript_response, speech_to_text
 from utils.views.base import BaseModelViewSet
 from utils.views.mixins import PartialUpdateModelMixin
 
@@ -115,6 +121,34 @@ class OrphanChatViewSet(
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+    @extend_schema(
+        tags=("orphan_chats",),
+    )
+    @action(
+        detail=True,
+        methods=["get"],
+        url_path=r"messages/(?P<message_external_id>[^/.]+)/audio",
+        permission_classes=(HasSignedAudioUrl | APIKeyAuth,),
+    )
+    def message_audio(self, *args, **kwarg):
+        # signed urls are not tied to the user or api key of the request
+        if is_audio_url_signed(
+            self.request, kwarg["external_id"], kwarg["message_external_id"]
+        ):
+            chat = get_object_or_404(Chat, external_id=kwarg["external_id"])
+        else:
+            chat = self.get_object()
+        response = get_message_audio_response(
+            chat,
+            kwarg["message_external_id"],
+            asynchronous=isinstance(self.request._request, ASGIRequest),
+        )
+        if not response:
+            return Response(
+                {"error": "Audio not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+        return response
+
     @action(detail=False, methods=["post"])
     def transcribe(self, request, *args, **kwargs):
         language = request.data.get("language") or "en"
@@ -124,6 +158,13 @@ class OrphanChatViewSet(
             raise ValidationError("audio and engine are required")
         try:
             engine_id = STTEngine.get_id_from_name(engine)
+            if request.data.get("stream") in (True, "true"):
+                return get_transcript_response(
+                    engine_id,
+                    audio,
+                    language + "-IN",
+                    asynchronous=isinstance(request._request, ASGIRequest),
+                )
             transcript = speech_to_text(engine_id, audio, language + "-IN")
             return Response({"transcript": transcript})
         except Exception as e:
@@ -150,7 +191,7 @@ class OrphanChatViewSet(
         if not messages or len(messages) == 0:
             raise ValidationError("audio and engine are required")
         try:
-            client = openai.OpenAI(api_key=settings.OPENAI_API_KEY)
+            client = get_openai_client()
             completion = client.chat.completions.create(
                 model=model,
                 temperature=temperature,
@@ -1,6 +1,4 @@
-from django.conf import settings
 from django_filters.rest_framework import DjangoFilterBackend
-from openai import OpenAI
 from rest_framework import filters, status
 from rest_framework.decorators import action
 from rest_framework.mixins import (
@@ -14,6 +12,8 @@ from rest_framework.response import Response
 
 from ayushma.models import Project
 from ayushma.serializers.project import ProjectSerializer, ProjectUpdateSerializer
+from ayushma.utils.answer_cache import invalidate_answer_cache
+from ayushma.utils.openai_client import get_openai_client
 from ayushma.utils.vectordb import VectorDB
 from utils.views.base import BaseModelViewSet
 from utils.views.mixins import PartialUpdateModelMixin
@@ -66,6 +66,11 @@ class ProjectViewSet(
     def perform_create(self, serializer):
         serializer.save(creator=self.request.user)
 
+    def perform_update(self, serializer):
+        project = serializer.save()
+        # prompt or model may have changed
+        invalidate_answer_cache(project)
+
     def perform_destroy(self, instance):
         # delete namespaces from vectorDB
         try:
@@ -88,7 +93,7 @@ class ProjectViewSet(
         project: Project = Project.objects.get(external_id=kwarg["external_id"])
 
         # Since all the threads are attached to the api key, we use the env variable to avoid user confusion due to accidental key change
-        client = OpenAI(api_key=settings.OPENAI_API_KEY)
+        client = get_openai_client()
 
         if project.assistant_id:
             return Response(
@@ -114,7 +119,7 @@ class ProjectViewSet(
 
     @action(detail=True, methods=["get"])
     def list_assistants(self, *args, **kwarg):
-        client = OpenAI(api_key=settings.OPENAI_API_KEY)
+        client = get_openai_client()
 
         assistants = client.beta.assistants.list(
             order="desc",
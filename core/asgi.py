@@ -9,8 +9,12 @@ https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+
+from utils.asgi import DisconnectAwareASGIHandler
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings.local")
 
-application = get_asgi_application()
+# what get_asgi_application does, with a handler that notices disconnects
+django.setup(set_prefix=False)
+application = DisconnectAwareASGIHandler()
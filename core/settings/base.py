@@ -297,6 +297,8 @@ DJANGO_REST_RESET_TOKEN_EXPIRY_TIME = 10
 # EMAIL
 # ------------------------------------------------------------------------------
 CURRENT_DOMAIN = env("CURRENT_DOMAIN", default="http://localhost:8000")
+# where this api is served, for the absolute urls it hands out (message audio)
+API_URL = env("API_URL", default="http://localhost:8000")
 SUPPORT_EMAIL = env("SUPPORT_EMAIL", default="admin@localhost")
 # https://docs.djangoproject.com/en/dev/ref/settings/#default-from-email
 DEFAULT_FROM_EMAIL = env(
@@ -342,8 +344,75 @@ if OPENAI_API_TYPE == "azure":
 AZURE_CHAT_DEPLOYMENT = env("AZURE_CHAT_DEPLOYMENT", default="")
 AZURE_CHAT_MODEL = env("AZURE_CHAT_MODEL", default="")
 AZURE_EMBEDDING_DEPLOYMENT = env("AZURE_EMBEDDING_DEPLOYMENT", default="")
+# shared OpenAI clients: number of api keys kept, request timeout and retries in
+# seconds, seconds idle connections are kept alive and whether to use HTTP/2
+# (needs the h2 package, which is not in the Pipfile: pip install "httpx[http2]")
+OPENAI_CLIENT_CACHE_SIZE = env.int("OPENAI_CLIENT_CACHE_SIZE", default=32)
+OPENAI_TIMEOUT = env.float("OPENAI_TIMEOUT", default=180)
+OPENAI_MAX_RETRIES = env.int("OPENAI_MAX_RETRIES", default=2)
+OPENAI_KEEPALIVE_EXPIRY = env.float("OPENAI_KEEPALIVE_EXPIRY", default=60)
+OPENAI_HTTP2 = env.bool("OPENAI_HTTP2", default=False)
+# query embedding cache: entries kept in process, seconds kept in the shared cache
+EMBEDDING_CACHE_SIZE = env.int("EMBEDDING_CACHE_SIZE", default=1024)
+EMBEDDING_CACHE_TIMEOUT = env.int("EMBEDDING_CACHE_TIMEOUT", default=7 * 24 * 60 * 60)
+# translation cache: entries kept in process, seconds kept in the shared cache
+TRANSLATION_CACHE_SIZE = env.int("TRANSLATION_CACHE_SIZE", default=1024)
+TRANSLATION_CACHE_TIMEOUT = env.int(
+    "TRANSLATION_CACHE_TIMEOUT", default=7 * 24 * 60 * 60
+)
+# most recent cached answers compared against a new question, per project
+ANSWER_CACHE_MAX_ENTRIES = env.int("ANSWER_CACHE_MAX_ENTRIES", default=1000)
+
+# log the full prompts of the langchain chains
+LANGCHAIN_VERBOSE = env.bool("LANGCHAIN_VERBOSE", default=False)
+# chat history sent to the model: at most this many tokens (and a quarter of the
+# model's context window) from the last CHAT_HISTORY_MAX_MESSAGES messages
+CHAT_HISTORY_MAX_TOKENS = env.int("CHAT_HISTORY_MAX_TOKENS", default=4000)
+CHAT_HISTORY_MAX_MESSAGES = env.int("CHAT_HISTORY_MAX_MESSAGES", default=50)
+# add a summary of the older messages, cached for this many seconds
+CHAT_HISTORY_SUMMARY = env.bool("CHAT_HISTORY_SUMMARY", default=False)
+CHAT_HISTORY_SUMMARY_TIMEOUT = env.int(
+    "CHAT_HISTORY_SUMMARY_TIMEOUT", default=7 * 24 * 60 * 60
+)
+# threads summarising chat histories in the background
+CHAT_HISTORY_SUMMARY_WORKERS = env.int("CHAT_HISTORY_SUMMARY_WORKERS", default=2)
+# threads fetching references while the question is stored and the history loaded
+CONTEXT_RETRIEVAL_WORKERS = env.int("CONTEXT_RETRIEVAL_WORKERS", default=16)
+
+# seconds to wait for the next streamed token before giving up on a response
+STREAM_TOKEN_TIMEOUT = env.int("STREAM_TOKEN_TIMEOUT", default=60)
+# coalesce streamed tokens into chunks of this many bytes / seconds (0 disables)
+STREAM_FLUSH_SIZE = env.int("STREAM_FLUSH_SIZE", default=0)
+STREAM_FLUSH_INTERVAL = env.float("STREAM_FLUSH_INTERVAL", default=0)
+# send only deltas while streaming, the full message is sent with the stop event
+STREAM_DELTA_ONLY = env.bool("STREAM_DELTA_ONLY", default=False)
+
+# translate and synthesise streamed answers sentence by sentence while they are
+# generated, in up to TTS_WORKERS threads; the stored message is still translated
+# as a whole
+INCREMENTAL_TTS = env.bool("INCREMENTAL_TTS", default=True)
+TTS_WORKERS = env.int("TTS_WORKERS", default=8)
+# long texts are synthesised in segments of at most this many characters (bytes
+# for google), in up to TTS_SEGMENT_WORKERS concurrent requests
+TTS_SEGMENT_LENGTH = env.int("TTS_SEGMENT_LENGTH", default=1000)
+TTS_SEGMENT_WORKERS = env.int("TTS_SEGMENT_WORKERS", default=8)
+# reuse the stored audio of texts that were voiced before
+TTS_CACHE = env.bool("TTS_CACHE", default=True)
+# synthesised audio is streamed through the cache: seconds the audio endpoint
+# waits for the next chunk, and seconds the chunks are kept
+TTS_STREAM_TIMEOUT = env.int("TTS_STREAM_TIMEOUT", default=30)
+TTS_STREAM_CACHE_TIMEOUT = env.int("TTS_STREAM_CACHE_TIMEOUT", default=10 * 60)
 
 # Speech to text
+# convert uploads to mono 16 kHz ogg/opus with the silence trimmed (needs ffmpeg)
+STT_PREPROCESS = env.bool("STT_PREPROCESS", default=True)
+STT_SILENCE_THRESHOLD = env.int("STT_SILENCE_THRESHOLD", default=-50)
+STT_BITRATE = env("STT_BITRATE", default="24k")
+# longer recordings are split on pauses into chunks of at most this many seconds
+# (0 disables) overlapping by STT_CHUNK_OVERLAP, transcribed by STT_WORKERS threads
+STT_CHUNK_SECONDS = env.int("STT_CHUNK_SECONDS", default=30)
+STT_CHUNK_OVERLAP = env.float("STT_CHUNK_OVERLAP", default=0.5)
+STT_WORKERS = env.int("STT_WORKERS", default=4)
 STT_API_KEY = env("STT_API_KEY", default="")  # Not required for google
 
 # Pinecone
@@ -351,6 +420,32 @@ PINECONE_API_KEY = env("PINECONE_API_KEY", default="")
 PINECONE_INDEX = env("PINECONE_INDEX", default="")
 
 VECTOR_DB = env("VECTOR_DB", default="milvus")
+# seconds to trust cached collection/partition metadata of the vector db
+VECTOR_DB_METADATA_TTL = env.int("VECTOR_DB_METADATA_TTL", default=300)
+
+# how documents are split before embedding: "token" or "line"
+DOCUMENT_CHUNKER = env("DOCUMENT_CHUNKER", default="token")
+# target and overlap size of a chunk in tokens (DOCUMENT_CHUNKER=token)
+CHUNK_SIZE = env.int("CHUNK_SIZE", default=256)
+CHUNK_OVERLAP = env.int("CHUNK_OVERLAP", default=32)
+
+# keep document embeddings in the database so re-indexing does not embed them again
+EMBEDDING_STORE = env.bool("EMBEDDING_STORE", default=True)
+# embedding requests in flight, and requests and tokens per minute (0 disables the
+# limit) while upserting documents
+EMBEDDING_CONCURRENCY = env.int("EMBEDDING_CONCURRENCY", default=4)
+EMBEDDING_REQUESTS_PER_MINUTE = env.int("EMBEDDING_REQUESTS_PER_MINUTE", default=0)
+EMBEDDING_TOKENS_PER_MINUTE = env.int("EMBEDDING_TOKENS_PER_MINUTE", default=0)
+# tokens sent in one embedding request while upserting documents
+EMBEDDING_BATCH_TOKENS = env.int("EMBEDDING_BATCH_TOKENS", default=50000)
+# vectors written to the vector db at once while upserting documents
+VECTOR_DB_WRITE_BATCH_SIZE = env.int("VECTOR_DB_WRITE_BATCH_SIZE", default=1000)
+# processes used to extract the text of PDF pages while upserting documents
+PDF_EXTRACTION_WORKERS = env.int("PDF_EXTRACTION_WORKERS", default=4)
+
+# Local vector db (VECTOR_DB=local)
+LOCAL_VECTOR_DB_PATH = env("LOCAL_VECTOR_DB_PATH", default=str(ROOT_DIR / "vectordb"))
+LOCAL_VECTOR_DB_COLLECTION = env("LOCAL_VECTOR_DB_COLLECTION", default="ayushma")
 
 # Milvus
 MILVUS_URL = env("MILVUS_URL", default="http://milvus:19530")
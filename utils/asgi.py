@@ -0,0 +1,60 @@
+import asyncio
+import contextlib
+
+from asgiref.sync import sync_to_async
+from django.core import signals
+from django.core.handlers.asgi import ASGIHandler
+
+
+class DisconnectAwareASGIHandler(ASGIHandler):
+    """
+    Stops serving a response when its client disconnects.
+
+    Django 4.2 stops reading from the connection once the request body is in,
+    and uvicorn drops what is sent after a disconnect without an error, so a
+    streamed response was generated to the end for nobody (the model kept
+    answering and the answer kept being voiced). Like Django 5.0, the handler
+    listens for the disconnect and cancels the response, which closes its
+    generator.
+    """
+
+    async def handle(self, scope, receive, send):
+        body_received = asyncio.Event()
+        response_complete = False
+
+        async def receive_body():
+            message = await receive()
+            if message["type"] != "http.request" or not message.get("more_body"):
+                body_received.set()
+            return message
+
+        async def send_response(message):
+            nonlocal response_complete
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body"):
+                response_complete = True
+
+        async def listen_for_disconnect():
+            await body_received.wait()
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        handler = asyncio.create_task(
+            super().handle(scope, receive_body, send_response)
+        )
+        listener = asyncio.create_task(listen_for_disconnect())
+        await asyncio.wait([handler, listener], return_when=asyncio.FIRST_COMPLETED)
+        listener.cancel()
+        # the server reports a disconnect after a complete response too, which
+        # is only being closed (request_finished is sent) and must not be cancelled
+        if not handler.done() and not response_complete:
+            handler.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await handler
+            # sent when the response is closed, which a cancelled one is not, and
+            # closes the database connections of the request
+            await sync_to_async(signals.request_finished.send, thread_sensitive=True)(
+                sender=self.__class__
+            )
+            return
+        await handler